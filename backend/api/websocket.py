@@ -5,14 +5,25 @@ import json
 import time
 from collections import defaultdict
 
+import msgpack
 import redis
 import structlog
 from fastapi import WebSocket, WebSocketDisconnect
+from starlette.websockets import WebSocketState
 
 from config import settings
 
 logger = structlog.get_logger()
 
+# Subprotocolo negociado por clientes que preferem frames binários MessagePack
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+# Erros que indicam conexão morta durante o envio (demais exceções propagam)
+_DEAD_CONNECTION_ERRORS = (WebSocketDisconnect, ConnectionError, asyncio.TimeoutError, RuntimeError)
+
+# Resposta constante ao ping, serializada uma única vez
+_PONG = json.dumps({"type": "pong"})
+
 # Redis client síncrono para publicar (usado pelo Celery worker)
 _redis_sync = None
 
@@ -58,11 +69,21 @@ class ConnectionManager:
 
     def __init__(self) -> None:
         self.connections: dict[str, list[WebSocket]] = defaultdict(list)
+        self._msgpack_clients: set[WebSocket] = set()
         self._subscriber_task: asyncio.Task | None = None
 
     async def connect(self, websocket: WebSocket, project_id: str) -> None:
-        """Aceita e registra uma nova conexão WebSocket."""
-        await websocket.accept()
+        """Aceita e registra uma nova conexão WebSocket.
+
+        Se o cliente oferecer o subprotocolo "msgpack", o progresso é enviado
+        em frames binários MessagePack em vez de texto JSON.
+        """
+        requested = websocket.scope.get("subprotocols") or []
+        if MSGPACK_SUBPROTOCOL in requested:
+            await websocket.accept(subprotocol=MSGPACK_SUBPROTOCOL)
+            self._msgpack_clients.add(websocket)
+        else:
+            await websocket.accept()
         self.connections[project_id].append(websocket)
         logger.info("ws_conectado", project_id=project_id)
 
@@ -74,19 +95,42 @@ class ConnectionManager:
             ]
             if not self.connections[project_id]:
                 del self.connections[project_id]
+        self._msgpack_clients.discard(websocket)
         logger.info("ws_desconectado", project_id=project_id)
 
     async def send_to_project(self, project_id: str, data: str) -> None:
-        """Envia dados para todos os clientes de um projeto."""
+        """Envia dados para todos os clientes de um projeto.
+
+        O payload MessagePack é gerado uma única vez por broadcast e
+        compartilhado entre todos os clientes que negociaram o subprotocolo.
+        """
         dead_connections = []
+        packed: bytes | None = None
         for ws in self.connections.get(project_id, []):
             try:
-                await ws.send_text(data)
-            except Exception:
+                if ws in self._msgpack_clients:
+                    if packed is None:
+                        packed = msgpack.packb(json.loads(data), use_bin_type=True)
+                    await ws.send_bytes(packed)
+                else:
+                    await ws.send_text(data)
+            except _DEAD_CONNECTION_ERRORS as e:
+                logger.debug("ws_envio_falhou", project_id=project_id, error=str(e))
                 dead_connections.append(ws)
         for ws in dead_connections:
+            await self._close_quietly(ws)
             self.disconnect(ws, project_id)
 
+    @staticmethod
+    async def _close_quietly(ws: WebSocket) -> None:
+        """Fecha o WebSocket (código 1011) para liberar o transporte."""
+        if ws.client_state == WebSocketState.DISCONNECTED:
+            return
+        try:
+            await ws.close(code=1011)
+        except _DEAD_CONNECTION_ERRORS:
+            pass
+
     def start_redis_subscriber(self) -> None:
         """Inicia subscriber Redis em background para receber progresso do Celery."""
         if self._subscriber_task is None:
@@ -135,7 +179,7 @@ async def websocket_endpoint(websocket: WebSocket, project_id: str) -> None:
         while True:
             data = await websocket.receive_text()
             if data == "ping":
-                await websocket.send_text(json.dumps({"type": "pong"}))
+                await websocket.send_text(_PONG)
     except WebSocketDisconnect:
         manager.disconnect(websocket, project_id)
     except Exception:
@@ -1,5 +1,6 @@
 """Configurações centrais do ClovisAI."""
 
+from functools import cache, cached_property
 from pathlib import Path
 
 from pydantic_settings import BaseSettings
@@ -34,6 +35,33 @@ class Settings(BaseSettings):
     applio_path: Path = _PROJECT_ROOT / "engines" / "applio" / "repo"
     voicebanks_path: Path = _PROJECT_ROOT / "engines" / "voicebanks"
 
+    # Precisão reduzida (bfloat16) na separação Demucs — requer suporte nativo do hardware
+    demucs_bf16: bool = False
+
+    # Precisão dos modelos DiffSinger: "fp32", "fp16" ou "int8" (usa *.int8.onnx /
+    # *.fp16.onnx gerados por scripts/quantize_voicebank.py quando existirem)
+    diffsinger_precision: str = "fp32"
+
+    # Arena de memória do ONNX Runtime, compartilhada entre as sessões DiffSinger.
+    # False aloca por execução: menos memória residente em uso esporádico
+    diffsinger_mem_arena: bool = True
+
+    # Estimador de f0 da extração de melodia: "auto" (torchcrepe com CUDA, senão
+    # pyin), "torchcrepe", "pyworld" ou "pyin". Sem a dependência instalada, usa pyin
+    melody_pitch_backend: str = "auto"
+
+    # Cache em disco do áudio decodificado para extração de melodia (LRU)
+    melody_audio_cache_max_mb: int = 1024
+
+    # Cache em disco dos feeds de duração/pitch do DiffSinger (LRU)
+    diffsinger_feeds_cache_max_mb: int = 256
+
+    # Device do ACE-Step: "auto" (cuda > mps > cpu), "cuda", "mps" ou "cpu"
+    acestep_device: str = "auto"
+
+    # Cache em disco de renders ACE-Step determinísticos (seed fixa)
+    acestep_cache_max_mb: int = 2048
+
     # Processing limits
     max_upload_size_mb: int = 500
     max_concurrent_jobs: int = 2
@@ -42,7 +70,7 @@ class Settings(BaseSettings):
     # Allowed audio formats
     allowed_audio_formats: list[str] = ["wav", "mp3", "flac", "ogg", "m4a"]
 
-    @property
+    @cached_property
     def projects_path(self) -> Path:
         """Caminho para armazenamento de projetos."""
         return self.storage_path / "projects"
@@ -50,4 +78,10 @@ class Settings(BaseSettings):
     model_config = {"env_file": ".env", "env_file_encoding": "utf-8"}
 
 
-settings = Settings()
+@cache
+def get_settings() -> Settings:
+    """Retorna a instância única de configurações (construída uma vez)."""
+    return Settings()
+
+
+settings = get_settings()
@@ -1,5 +1,6 @@
 """Configuração do banco de dados SQLAlchemy async."""
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase
 
@@ -7,6 +8,28 @@ from config import settings
 
 engine = create_async_engine(settings.database_url, echo=False)
 
+# PRAGMAs aplicados a cada conexão SQLite. WAL permite leituras concorrentes
+# enquanto o pipeline grava atualizações de progresso.
+_SQLITE_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "temp_store=MEMORY",
+    "mmap_size=268435456",
+    "cache_size=-20000",
+    "foreign_keys=ON",
+)
+
+if engine.dialect.name == "sqlite":
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, _connection_record) -> None:
+        """Configura PRAGMAs de performance em cada nova conexão SQLite."""
+        cursor = dbapi_conn.cursor()
+        for pragma in _SQLITE_PRAGMAS:
+            cursor.execute(f"PRAGMA {pragma}")
+        cursor.close()
+
+
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
@@ -45,8 +45,8 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=cors_origins,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization", "X-Requested-With"],
 )
 
 # Registrar rotas
@@ -79,6 +79,20 @@ async def startup() -> None:
     logger.info("app_pronta", storage=str(settings.storage_path))
 
 
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    """Finalização da aplicação."""
+    # Só encerra os pools dos módulos já carregados (evita importar librosa aqui)
+    import sys
+
+    analyzer = sys.modules.get("services.analyzer")
+    if analyzer is not None:
+        analyzer.shutdown_analyze_pool()
+    melody = sys.modules.get("services.melody")
+    if melody is not None:
+        melody.shutdown_melody_pool()
+
+
 @app.get("/api/health")
 async def health_check() -> dict:
     """Endpoint de health check."""
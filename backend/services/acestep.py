@@ -1,7 +1,14 @@
 """Wrapper para ACE-Step — geração vocal/musical com IA."""
 
 import asyncio
+import hashlib
+import json
+import shutil
+import sqlite3
 import sys
+import time
+from contextlib import closing
+from functools import lru_cache
 from pathlib import Path
 
 import numpy as np
@@ -14,6 +21,15 @@ logger = structlog.get_logger()
 _pipeline_instance = None
 _pipeline_loading = False
 
+# Serializa o uso do pipeline: gerações concorrentes disputariam CPU/GPU e memória
+_ACESTEP_SEM = asyncio.Semaphore(1)
+
+# Classe ACEStepPipeline resolvida no primeiro import bem-sucedido
+_pipeline_cls = None
+
+# (amplitude, harmônico) do drone usado como placeholder
+_PLACEHOLDER_HARMONICS = ((0.5, 1), (0.2, 2), (0.1, 3), (0.05, 4))
+
 
 class ACEStepConfig:
     """Configurações para geração ACE-Step."""
@@ -165,6 +181,115 @@ def build_acestep_prompt(
     return ", ".join(parts)
 
 
+@lru_cache(maxsize=8)
+def _fade_ramps(fade_samples: int) -> tuple[np.ndarray, np.ndarray]:
+    """Rampas de fade in/out (somente leitura, cacheadas por tamanho)."""
+    fade_in = np.linspace(0, 1, fade_samples, dtype=np.float32)
+    fade_out = fade_in[::-1].copy()
+    fade_in.flags.writeable = False
+    fade_out.flags.writeable = False
+    return fade_in, fade_out
+
+
+def _select_device(preference: str = "auto") -> tuple[str, str]:
+    """Escolhe (device, dtype) do pipeline conforme o hardware disponível."""
+    if preference == "cpu":
+        return "cpu", "float32"
+
+    import torch
+
+    if preference in ("auto", "cuda") and torch.cuda.is_available():
+        return "cuda", "bfloat16"
+    if preference in ("auto", "mps") and torch.backends.mps.is_available():
+        return "mps", "float16"
+    return "cpu", "float32"
+
+
+def _file_signature(path: Path, sample_bytes: int = 1 << 20) -> bytes:
+    """Assinatura barata de um arquivo: tamanho + primeiro e último MB."""
+    size = path.stat().st_size
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        h.update(f.read(sample_bytes))
+        if size > sample_bytes:
+            f.seek(max(sample_bytes, size - sample_bytes))
+            h.update(f.read(sample_bytes))
+    return h.digest()
+
+
+class RenderCache:
+    """Cache LRU em disco de renders ACE-Step, indexado em SQLite."""
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._db_path = cache_dir / "index.sqlite"
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, path TEXT NOT NULL, "
+                "size INTEGER NOT NULL, mtime REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._db_path, timeout=10)
+
+    @staticmethod
+    def make_key(
+        config: ACEStepConfig,
+        ref_audio_path: Path | None = None,
+        ref_strength: float = 0.5,
+    ) -> str:
+        """Gera a chave do cache a partir da config e do áudio de referência."""
+        payload = json.dumps(config.to_dict(), sort_keys=True).encode()
+        h = hashlib.blake2b(payload, digest_size=16)
+        if ref_audio_path is not None and ref_audio_path.exists():
+            h.update(_file_signature(ref_audio_path))
+            h.update(str(ref_strength).encode())
+        return h.hexdigest()
+
+    def get(self, key: str, output_path: Path) -> bool:
+        """Copia o render em cache para output_path. Retorna False se não houver."""
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT path FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return False
+            cached = Path(row[0])
+            if not cached.exists():
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return False
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(cached, output_path)
+            conn.execute("UPDATE cache SET mtime = ? WHERE key = ?", (time.time(), key))
+        return True
+
+    def put(self, key: str, source_path: Path) -> None:
+        """Armazena uma cópia do render e aplica a evicção LRU."""
+        dest = self.cache_dir / f"{key}{source_path.suffix}"
+        shutil.copyfile(source_path, dest)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, path, size, mtime) VALUES (?, ?, ?, ?)",
+                (key, str(dest), dest.stat().st_size, time.time()),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Remove as entradas menos usadas até caber no limite de tamanho."""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, path, size in conn.execute(
+            "SELECT key, path, size FROM cache ORDER BY mtime ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            Path(path).unlink(missing_ok=True)
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            total -= size
+
+
 class ACEStepService:
     """Serviço de geração vocal/musical usando ACE-Step."""
 
@@ -172,6 +297,14 @@ class ACEStepService:
         from config import settings
         self.engine_path = engine_path or settings.acestep_path
         self.model_path = settings.acestep_model_path
+        self.device_preference = settings.acestep_device
+
+        # Repo adicionado ao sys.path uma única vez, na construção do serviço
+        repo_str = str(self.engine_path)
+        if self.engine_path.exists() and repo_str not in sys.path:
+            sys.path.insert(0, repo_str)
+        self._cache_dir = settings.storage_path / "cache" / "acestep"
+        self._cache_max_bytes = settings.acestep_cache_max_mb * 1024 * 1024
 
     def is_available(self) -> bool:
         """Verifica se o ACE-Step está instalado."""
@@ -184,7 +317,7 @@ class ACEStepService:
 
     def _get_pipeline(self):
         """Retorna pipeline singleton (carrega modelo uma vez só)."""
-        global _pipeline_instance, _pipeline_loading
+        global _pipeline_instance, _pipeline_loading, _pipeline_cls
 
         if _pipeline_instance is not None:
             return _pipeline_instance
@@ -194,22 +327,24 @@ class ACEStepService:
 
         _pipeline_loading = True
         try:
-            # Adicionar repo ao sys.path para imports
-            repo_str = str(self.engine_path)
-            if repo_str not in sys.path:
-                sys.path.insert(0, repo_str)
+            if _pipeline_cls is None:
+                from acestep.pipeline_ace_step import ACEStepPipeline
+                _pipeline_cls = ACEStepPipeline
 
-            from acestep.pipeline_ace_step import ACEStepPipeline
+            device, dtype = _select_device(self.device_preference)
 
             logger.info(
                 "acestep_carregando_modelo",
                 checkpoint=str(self.model_path),
+                device=device,
+                dtype=dtype,
             )
 
-            _pipeline_instance = ACEStepPipeline(
+            # Em GPU o modelo fica residente; offload só faz sentido em CPU
+            _pipeline_instance = _pipeline_cls(
                 checkpoint_dir=str(self.model_path),
-                dtype="float32",  # CPU-friendly (bfloat16 para GPU)
-                cpu_offload=True,
+                dtype=dtype,
+                cpu_offload=device == "cpu",
             )
 
             logger.info("acestep_modelo_carregado")
@@ -235,9 +370,10 @@ class ACEStepService:
             ref_strength: Força da referência (0.0-1.0). Maior = mais similar ao ref.
                 0.5 é bom para manter timing/melodia mas mudar a voz.
         """
-        return await asyncio.to_thread(
-            self._generate_sync, output_path, config, ref_audio_path, ref_strength
-        )
+        async with _ACESTEP_SEM:
+            return await asyncio.to_thread(
+                self._generate_sync, output_path, config, ref_audio_path, ref_strength
+            )
 
     def _generate_sync(
         self,
@@ -275,6 +411,16 @@ class ACEStepService:
           Ideal para voice replacement quando o ref é o vocal original.
         """
         try:
+            # Renders só são determinísticos com seed fixa
+            cache = None
+            cache_key = None
+            if config.seed >= 0:
+                cache = RenderCache(self._cache_dir, self._cache_max_bytes)
+                cache_key = RenderCache.make_key(config, ref_audio_path, ref_strength)
+                if cache.get(cache_key, output_path):
+                    logger.info("acestep_cache_hit", key=cache_key, output=str(output_path))
+                    return output_path
+
             pipeline = self._get_pipeline()
 
             output_path.parent.mkdir(parents=True, exist_ok=True)
@@ -321,6 +467,9 @@ class ACEStepService:
                 batch_size=1,
             )
 
+            if cache is not None and output_path.exists():
+                cache.put(cache_key, output_path)
+
             logger.info("acestep_geracao_concluida", output=str(output_path))
             return output_path
 
@@ -340,27 +489,32 @@ class ACEStepService:
         # Gerar um drone vocal simples como placeholder
         t = np.linspace(0, duration, total_samples, endpoint=False)
 
-        # Frequência base que varia lentamente (simula melodia)
+        # Frequência base com vibrato: f(t) = base + depth·sin(2π·rate·t)
         base_freq = 220.0  # A3
-        vibrato = 5.0 * np.sin(2 * np.pi * 5.5 * t)  # Vibrato 5.5Hz
-        freq_contour = base_freq + vibrato
-
-        # Fase instantânea
-        phase = 2 * np.pi * np.cumsum(freq_contour) / sr
-
-        # Fundamental + harmônicos
-        audio = (
-            0.5 * np.sin(phase)
-            + 0.2 * np.sin(2 * phase)
-            + 0.1 * np.sin(3 * phase)
-            + 0.05 * np.sin(4 * phase)
-        ).astype(np.float32)
+        vibrato_depth = 5.0
+        vibrato_rate = 5.5  # Hz
+
+        # Fase instantânea pela integral analítica de f(t) (sem cumsum),
+        # reduzida a [0, 2π) para manter precisão em float32
+        w_v = 2 * np.pi * vibrato_rate
+        phase = 2 * np.pi * base_freq * t + (2 * np.pi * vibrato_depth / w_v) * (1 - np.cos(w_v * t))
+        phase = np.mod(phase, 2 * np.pi).astype(np.float32)
+
+        # Fundamental + harmônicos acumulados in-place num único buffer de trabalho
+        audio = np.zeros(total_samples, dtype=np.float32)
+        scratch = np.empty_like(audio)
+        for amp, harmonic in _PLACEHOLDER_HARMONICS:
+            np.multiply(phase, harmonic, out=scratch)
+            np.sin(scratch, out=scratch)
+            scratch *= amp
+            audio += scratch
 
         # Fade in/out
         fade_samples = int(0.5 * sr)
         if fade_samples > 0 and total_samples > 2 * fade_samples:
-            audio[:fade_samples] *= np.linspace(0, 1, fade_samples).astype(np.float32)
-            audio[-fade_samples:] *= np.linspace(1, 0, fade_samples).astype(np.float32)
+            fade_in, fade_out = _fade_ramps(fade_samples)
+            audio[:fade_samples] *= fade_in
+            audio[-fade_samples:] *= fade_out
 
         audio *= 0.4
 
@@ -1,41 +1,145 @@
 """Serviço de análise de áudio — BPM, tonalidade, waveform."""
 
 import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import librosa
 import numpy as np
+import soundfile as sf
 import structlog
+from numba import njit
 
 from api.schemas import AudioAnalysis
 
 logger = structlog.get_logger()
 
+# Taxa usada na análise de BPM/tonalidade (suficiente para beat tracking e chroma)
+ANALYSIS_SR = 22050
+
+# Parâmetros da STFT compartilhada entre beat tracking e chroma
+_N_FFT = 2048
+_HOP_LENGTH = 512
+
+# Quantidade de picos calculados por leitura de bloco no streaming de waveform
+_PEAKS_PER_BLOCK = 64
+
+# Pool de processos compartilhado pelas análises (criado sob demanda)
+_ANALYZE_POOL: ProcessPoolExecutor | None = None
+
 # Mapeamento de pitch classes para nomes de notas
 PITCH_CLASS_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
 
+# Perfis de Krumhansl-Schmuckler para major e minor
+_MAJOR_PROFILE = np.array(
+    [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88],
+    dtype=np.float32,
+)
+_MINOR_PROFILE = np.array(
+    [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17],
+    dtype=np.float32,
+)
+
+# Perfis em z-score, normalizados para norma 1: o produto interno com uma
+# rotação centralizada e normalizada do chroma é a correlação de Pearson.
+_MAJOR_Z = (_MAJOR_PROFILE - _MAJOR_PROFILE.mean()) / _MAJOR_PROFILE.std()
+_MINOR_Z = (_MINOR_PROFILE - _MINOR_PROFILE.mean()) / _MINOR_PROFILE.std()
+_PROFILES_UNIT = np.stack([_MAJOR_Z, _MINOR_Z], axis=1) / np.float32(np.sqrt(12))
+
+
+@njit(fastmath=True, cache=True)
+def _peaks_kernel(y: np.ndarray, num_peaks: int, chunk_size: int) -> np.ndarray:
+    """abs + max por bucket em uma única passada, sem array temporário.
+
+    O último bucket absorve as amostras que sobram da divisão inteira.
+    """
+    out = np.empty(num_peaks, dtype=np.float32)
+    n = y.shape[0]
+    for i in range(num_peaks):
+        start = i * chunk_size
+        end = n if i == num_peaks - 1 else start + chunk_size
+        peak = 0.0
+        for j in range(start, end):
+            v = abs(y[j])
+            if v > peak:
+                peak = v
+        out[i] = peak
+    return out
+
+
+def _get_analyze_pool() -> ProcessPoolExecutor:
+    """Retorna o pool de análise, criando-o na primeira chamada.
+
+    Usa spawn para não herdar por fork as threads do event loop e do torch.
+    """
+    global _ANALYZE_POOL
+    if _ANALYZE_POOL is None:
+        _ANALYZE_POOL = ProcessPoolExecutor(
+            max_workers=max(1, (os.cpu_count() or 2) // 2),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _ANALYZE_POOL
+
+
+def shutdown_analyze_pool() -> None:
+    """Encerra o pool de análise, se tiver sido criado."""
+    global _ANALYZE_POOL
+    if _ANALYZE_POOL is not None:
+        _ANALYZE_POOL.shutdown(wait=False, cancel_futures=True)
+        _ANALYZE_POOL = None
+
+
+def _analyze_in_worker(file_path: Path) -> AudioAnalysis:
+    """Ponto de entrada picklável executado nos processos do pool."""
+    return AudioAnalyzer()._analyze_sync(file_path)
+
 
 class AudioAnalyzer:
     """Analisa áudio instrumental para extrair metadados musicais."""
 
     async def analyze(self, file_path: Path) -> AudioAnalysis:
-        """Executa análise completa do áudio em thread separada."""
-        return await asyncio.to_thread(self._analyze_sync, file_path)
+        """Executa análise completa do áudio no pool de processos.
+
+        Vários uploads simultâneos analisam em paralelo real, sem disputar o GIL.
+        Dentro de um processo daemon (worker prefork do Celery) não é possível
+        criar processos filhos, então a análise roda numa thread.
+        """
+        if multiprocessing.current_process().daemon:
+            return await asyncio.to_thread(self._analyze_sync, file_path)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_analyze_pool(), _analyze_in_worker, file_path)
 
     def _analyze_sync(self, file_path: Path) -> AudioAnalysis:
-        """Análise síncrona do áudio (roda em thread)."""
+        """Análise síncrona do áudio (roda em processo do pool)."""
         logger.info("analise_iniciada", file=str(file_path))
 
-        # Carregar áudio
-        y, sr = librosa.load(str(file_path), sr=None)
+        # Taxa original do arquivo (metadado); a análise roda em ANALYSIS_SR
+        native_sr = librosa.get_samplerate(str(file_path))
+
+        # Carregar áudio mono float32 com resampler rápido
+        y, sr = librosa.load(
+            str(file_path), sr=ANALYSIS_SR, mono=True, res_type="soxr_lq", dtype=np.float32
+        )
         duration = librosa.get_duration(y=y, sr=sr)
 
-        # Detectar BPM
-        tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
+        # Espectrograma de potência calculado uma vez para BPM e tonalidade
+        power_spec = np.abs(librosa.stft(y, n_fft=_N_FFT, hop_length=_HOP_LENGTH)) ** 2
+
+        # Detectar BPM (onset envelope equivalente ao padrão do librosa)
+        mel = librosa.feature.melspectrogram(S=power_spec, sr=sr)
+        onset_env = librosa.onset.onset_strength(S=librosa.power_to_db(mel), sr=sr)
+        tempo, _ = librosa.beat.beat_track(
+            onset_envelope=onset_env, sr=sr, hop_length=_HOP_LENGTH
+        )
         bpm = float(np.round(tempo, 1)) if np.isscalar(tempo) else float(np.round(tempo[0], 1))
 
         # Detectar tonalidade usando chroma features
-        musical_key = self._detect_key(y, sr)
+        chroma = librosa.feature.chroma_stft(
+            S=power_spec, sr=sr, n_fft=_N_FFT, hop_length=_HOP_LENGTH
+        )
+        musical_key = self._detect_key(chroma)
 
         # Gerar waveform peaks para visualização
         waveform_peaks = self._generate_peaks(y, num_peaks=500)
@@ -48,58 +152,42 @@ class AudioAnalyzer:
             duration=round(duration, 2),
             bpm=bpm,
             key=musical_key,
-            sr=sr,
+            sr=native_sr,
         )
 
         return AudioAnalysis(
             duration_seconds=round(duration, 2),
-            sample_rate=sr,
+            sample_rate=native_sr,
             bpm=bpm,
             musical_key=musical_key,
             audio_format=audio_format,
             waveform_peaks=waveform_peaks,
         )
 
-    def _detect_key(self, y: np.ndarray, sr: int) -> str:
+    def _detect_key(self, chroma: np.ndarray) -> str:
         """Detecta a tonalidade musical usando perfil de Krumhansl-Schmuckler."""
-        chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
-        chroma_mean = np.mean(chroma, axis=1)
+        chroma_mean = np.mean(chroma, axis=1).astype(np.float32)
 
-        # Perfis de Krumhansl-Schmuckler para major e minor
-        major_profile = np.array(
-            [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]
-        )
-        minor_profile = np.array(
-            [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]
-        )
-
-        best_corr = -1
-        best_key = "C"
-
-        for i in range(12):
-            rotated_chroma = np.roll(chroma_mean, -i)
+        # Matriz (12, 12) com todas as rotações do chroma centralizado
+        centered = chroma_mean - chroma_mean.mean()
+        tiled = np.concatenate([centered, centered])
+        rotations = np.lib.stride_tricks.sliding_window_view(tiled, 12)[:12]
+        norms = np.linalg.norm(rotations, axis=1, keepdims=True)
 
-            corr_major = np.corrcoef(rotated_chroma, major_profile)[0, 1]
-            if corr_major > best_corr:
-                best_corr = corr_major
-                best_key = f"{PITCH_CLASS_NAMES[i]} major"
+        # Correlações (12 tônicas × [major, minor]) em uma única multiplicação
+        with np.errstate(invalid="ignore", divide="ignore"):
+            corrs = (rotations / norms) @ _PROFILES_UNIT
 
-            corr_minor = np.corrcoef(rotated_chroma, minor_profile)[0, 1]
-            if corr_minor > best_corr:
-                best_corr = corr_minor
-                best_key = f"{PITCH_CLASS_NAMES[i]} minor"
-
-        return best_key
+        tonic, mode = np.unravel_index(np.argmax(corrs), corrs.shape)
+        return f"{PITCH_CLASS_NAMES[tonic]} {'major' if mode == 0 else 'minor'}"
 
     def _generate_peaks(self, y: np.ndarray, num_peaks: int = 500) -> list[float]:
         """Gera lista de picos para renderização de waveform."""
-        chunk_size = max(1, len(y) // num_peaks)
-        peaks = []
-        for i in range(0, len(y), chunk_size):
-            chunk = y[i : i + chunk_size]
-            peak = float(np.max(np.abs(chunk)))
-            peaks.append(round(peak, 4))
-        return peaks[:num_peaks]
+        if len(y) < num_peaks:
+            return np.round(np.abs(y).astype(np.float64), 4).tolist()
+
+        peaks = _peaks_kernel(np.ascontiguousarray(y), num_peaks, len(y) // num_peaks)
+        return np.round(peaks.astype(np.float64), 4).tolist()
 
     async def generate_waveform_peaks(
         self, file_path: Path, num_peaks: int = 500
@@ -108,6 +196,35 @@ class AudioAnalyzer:
         return await asyncio.to_thread(self._generate_peaks_from_file, file_path, num_peaks)
 
     def _generate_peaks_from_file(self, file_path: Path, num_peaks: int) -> list[float]:
-        """Carrega áudio e gera peaks (síncrono)."""
-        y, _ = librosa.load(str(file_path), sr=22050)
-        return self._generate_peaks(y, num_peaks)
+        """Gera peaks lendo o arquivo em blocos, sem decodificar tudo em memória.
+
+        Formatos que o libsndfile não abre (ex.: m4a) caem no librosa.load.
+        """
+        try:
+            total_frames = sf.info(str(file_path)).frames
+        except RuntimeError:
+            y, _ = librosa.load(str(file_path), sr=22050)
+            return self._generate_peaks(y, num_peaks)
+
+        chunk_size = total_frames // num_peaks
+        if chunk_size == 0:
+            y, _ = sf.read(str(file_path), dtype="float32", always_2d=True)
+            return self._generate_peaks(y.mean(axis=1), num_peaks)
+
+        peaks = np.zeros(num_peaks, dtype=np.float32)
+        with sf.SoundFile(str(file_path)) as f:
+            for start in range(0, num_peaks, _PEAKS_PER_BLOCK):
+                count = min(_PEAKS_PER_BLOCK, num_peaks - start)
+                is_last = start + count == num_peaks
+                wanted = count * chunk_size
+                block = f.read(frames=-1 if is_last else wanted, dtype="float32", always_2d=True)
+                mono = np.abs(block.mean(axis=1))
+                if len(mono) < wanted:
+                    mono = np.pad(mono, (0, wanted - len(mono)))
+                block_peaks = mono[:wanted].reshape(count, chunk_size).max(axis=1)
+                # Amostras restantes do arquivo entram no último bucket
+                if is_last and len(mono) > wanted:
+                    block_peaks[-1] = max(block_peaks[-1], mono[wanted:].max())
+                peaks[start : start + count] = block_peaks
+
+        return np.round(peaks.astype(np.float64), 4).tolist()
@@ -1,6 +1,9 @@
 """Serviço de separação de fontes usando Demucs (htdemucs)."""
 
 import asyncio
+import hashlib
+import pickle
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
@@ -13,15 +16,117 @@ logger = structlog.get_logger()
 # Cache do modelo para evitar reload
 _model_cache = None
 
+_MODEL_NAME = "htdemucs"
+
+# Stems que uma separação completa deixa em output_dir
+_STEM_FILES = ("vocals", "drums", "bass", "other", "instrumental_separated")
+
+# Serializa o uso do modelo: chamadas concorrentes disputariam CPU/GPU e memória
+_DEMUCS_SEM = asyncio.Semaphore(1)
+
+
+def _input_signature(input_path: Path, sample_bytes: int = 1 << 20) -> str:
+    """Assinatura barata do input: primeiro MB + tamanho do arquivo."""
+    with open(input_path, "rb") as f:
+        head = f.read(sample_bytes)
+    size = str(input_path.stat().st_size).encode()
+    return hashlib.blake2b(head + size).hexdigest()[:16]
+
+
+def _cached_stems(output_dir: Path, input_sig: str) -> dict[str, Path] | None:
+    """Retorna os stems de uma separação anterior do mesmo input, se completos."""
+    sig_path = output_dir / ".sig"
+    paths = {name: output_dir / f"{name}.wav" for name in _STEM_FILES}
+    if not sig_path.exists() or not all(p.exists() for p in paths.values()):
+        return None
+    if sig_path.read_text().strip() != input_sig:
+        return None
+    paths["instrumental"] = paths.pop("instrumental_separated")
+    return paths
+
+
+def _weights_cache_paths() -> tuple[Path, Path]:
+    """Paths do cache local: pesos em safetensors + spec de construção."""
+    from config import settings
+
+    cache_dir = settings.storage_path / "cache" / "demucs"
+    return cache_dir / f"{_MODEL_NAME}.safetensors", cache_dir / f"{_MODEL_NAME}.spec.pkl"
+
+
+def _model_spec(model) -> dict:
+    """Classe e argumentos de construção do modelo (ou de cada modelo do bag)."""
+    from demucs.apply import BagOfModels
+
+    if isinstance(model, BagOfModels):
+        return {"bag": [_model_spec(m) for m in model.models], "weights": model.weights}
+    args, kwargs = model._init_args_kwargs
+    return {
+        "klass": model.__class__,
+        "args": args,
+        "kwargs": kwargs,
+        "segment": getattr(model, "segment", None),
+    }
+
+
+def _build_from_spec(spec: dict):
+    """Instancia a arquitetura (sem pesos) a partir da spec salva."""
+    if "bag" in spec:
+        from demucs.apply import BagOfModels
+
+        return BagOfModels([_build_from_spec(s) for s in spec["bag"]], weights=spec["weights"])
+    model = spec["klass"](*spec["args"], **spec["kwargs"])
+    if spec["segment"] is not None:
+        model.segment = spec["segment"]
+    return model
+
+
+def _load_cached_model():
+    """Carrega o modelo do cache safetensors (mmap). Retorna None se indisponível."""
+    weights_path, spec_path = _weights_cache_paths()
+    if not (weights_path.exists() and spec_path.exists()):
+        return None
+    try:
+        from safetensors.torch import load_model
+
+        with open(spec_path, "rb") as f:
+            spec = pickle.load(f)
+        model = _build_from_spec(spec)
+        load_model(model, str(weights_path))
+        model.eval()
+        logger.info("demucs_modelo_carregado_cache", path=str(weights_path))
+        return model
+    except Exception as e:
+        logger.warning("demucs_cache_invalido", error=str(e))
+        return None
+
+
+def _save_cached_model(model) -> None:
+    """Persiste pesos (safetensors) e spec para warm starts por mmap."""
+    weights_path, spec_path = _weights_cache_paths()
+    try:
+        from safetensors.torch import save_model
+
+        weights_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(spec_path, "wb") as f:
+            pickle.dump(_model_spec(model), f)
+        save_model(model, str(weights_path))
+    except Exception as e:
+        logger.warning("demucs_cache_nao_salvo", error=str(e))
+        weights_path.unlink(missing_ok=True)
+        spec_path.unlink(missing_ok=True)
+
 
 def _get_model():
-    """Carrega o modelo htdemucs (cached)."""
+    """Carrega o modelo htdemucs (cached em memória e em disco)."""
     global _model_cache
+    if _model_cache is None:
+        _model_cache = _load_cached_model()
     if _model_cache is None:
         from demucs.pretrained import get_model
-        logger.info("demucs_carregando_modelo", model="htdemucs")
-        _model_cache = get_model("htdemucs")
+        logger.info("demucs_carregando_modelo", model=_MODEL_NAME)
+        _model_cache = get_model(_MODEL_NAME)
         logger.info("demucs_modelo_carregado")
+        _save_cached_model(_model_cache)
     return _model_cache
 
 
@@ -38,9 +143,10 @@ class DemucsService:
 
         Retorna dict com paths: {"vocals": Path, "instrumental": Path}
         """
-        return await asyncio.to_thread(
-            self._separate_sync, input_path, output_dir, progress_fn,
-        )
+        async with _DEMUCS_SEM:
+            return await asyncio.to_thread(
+                self._separate_sync, input_path, output_dir, progress_fn,
+            )
 
     def _separate_sync(
         self,
@@ -52,6 +158,19 @@ class DemucsService:
         from demucs.apply import apply_model
         from demucs.audio import AudioFile
 
+        # Mesmo input já separado neste diretório: reaproveitar os stems
+        input_sig = _input_signature(input_path)
+        cached = _cached_stems(output_dir, input_sig)
+        if cached is not None:
+            logger.info("demucs_stems_reaproveitados", output_dir=str(output_dir))
+            if progress_fn:
+                progress_fn(95, "Separacao reaproveitada do cache")
+            return cached
+
+        # Invalida a assinatura antiga antes de sobrescrever qualquer stem: uma
+        # falha no meio não pode deixar stems misturados com um .sig válido
+        (output_dir / ".sig").unlink(missing_ok=True)
+
         model = _get_model()
         if progress_fn:
             progress_fn(10, "Modelo Demucs carregado")
@@ -62,18 +181,26 @@ class DemucsService:
         wav = AudioFile(input_path).read(
             streams=0, samplerate=model.samplerate, channels=model.audio_channels,
         )
+        # Normalização pela mixagem mono, com escalares e operações in-place
         ref = wav.mean(0)
-        wav = (wav - ref.mean()) / ref.std()
+        ref_mean, ref_std = ref.mean().item(), ref.std().item()
+        del ref
+        wav.sub_(ref_mean).div_(ref_std)
 
         if progress_fn:
             progress_fn(20, "Audio carregado, separando fontes...")
 
-        # Aplicar modelo
+        # Aplicar modelo (autocast bf16 opcional; entrada e saída ficam em float32)
+        from config import settings
+
         device = torch.device("mps") if torch.backends.mps.is_available() else torch.device("cpu")
-        sources = apply_model(
-            model, wav[None], device=device, progress=False, split=True,
-        )
-        sources = sources * ref.std() + ref.mean()
+        with torch.autocast(
+            device_type=device.type, dtype=torch.bfloat16, enabled=settings.demucs_bf16,
+        ):
+            sources = apply_model(
+                model, wav[None], device=device, progress=False, split=True,
+            )
+        sources = sources.float().mul_(ref_std).add_(ref_mean)
 
         if progress_fn:
             progress_fn(70, "Fontes separadas, salvando arquivos...")
@@ -81,37 +208,47 @@ class DemucsService:
         # sources shape: (1, n_sources, channels, samples)
         # sources order: drums, bass, other, vocals
         source_names = model.sources  # ['drums', 'bass', 'other', 'vocals']
+        source_idx = {name: i for i, name in enumerate(source_names)}
+
+        # Instrumental = drums + bass + other, somado no device antes da cópia
+        instrumental_idx = [source_idx["drums"], source_idx["bass"], source_idx["other"]]
+        instrumental_t = sources[0, instrumental_idx].sum(dim=0)
+
+        # Uma única transferência para CPU por tensor
+        stems = sources[0].cpu().numpy()  # (n_sources, channels, samples)
+        instrumental = instrumental_t.cpu().numpy()
 
         output_dir.mkdir(parents=True, exist_ok=True)
-        output_paths = {}
+        output_paths = {name: output_dir / f"{name}.wav" for name in source_names}
+        output_paths["instrumental"] = output_dir / "instrumental_separated.wav"
 
-        for i, name in enumerate(source_names):
-            source_wav = sources[0, i].cpu().numpy()  # (channels, samples)
-            out_path = output_dir / f"{name}.wav"
-            # soundfile espera (samples, channels)
-            sf.write(str(out_path), source_wav.T, model.samplerate)
-            output_paths[name] = out_path
-            logger.info("demucs_fonte_salva", name=name, path=str(out_path))
+        # soundfile espera (samples, channels) contíguo
+        to_write = [(output_paths[name], stems[i]) for name, i in source_idx.items()]
+        to_write.append((output_paths["instrumental"], instrumental))
 
-        if progress_fn:
-            progress_fn(85, "Criando faixa instrumental...")
+        # Stems em PCM_16, gravados em paralelo (sf.write libera o GIL)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [
+                executor.submit(
+                    sf.write, str(path), np.ascontiguousarray(data.T), model.samplerate,
+                    subtype="PCM_16",
+                )
+                for path, data in to_write
+            ]
+            for future in futures:
+                future.result()
 
-        # Criar instrumental = drums + bass + other
-        instrumental = (
-            sources[0, source_names.index("drums")]
-            + sources[0, source_names.index("bass")]
-            + sources[0, source_names.index("other")]
-        ).cpu().numpy()
+        # Assinatura gravada só após todos os stems estarem completos
+        (output_dir / ".sig").write_text(input_sig)
 
-        instrumental_path = output_dir / "instrumental_separated.wav"
-        sf.write(str(instrumental_path), instrumental.T, model.samplerate)
-        output_paths["instrumental"] = instrumental_path
+        for name, path in output_paths.items():
+            logger.info("demucs_fonte_salva", name=name, path=str(path))
 
         if progress_fn:
             progress_fn(95, "Separacao concluida")
 
         # Log qualidade da separação
-        vocals_rms = np.sqrt(np.mean(sources[0, source_names.index("vocals")].cpu().numpy() ** 2))
+        vocals_rms = np.sqrt(np.mean(stems[source_idx["vocals"]] ** 2))
         instr_rms = np.sqrt(np.mean(instrumental ** 2))
         logger.info(
             "demucs_separacao_concluida",
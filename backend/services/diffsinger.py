@@ -1,18 +1,76 @@
 """Wrapper para o engine DiffSinger — síntese vocal a partir de MIDI + letra."""
 
 import asyncio
+import hashlib
 import json
+import os
 import re
+import threading
+from functools import cache, lru_cache
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import numpy as np
 import soundfile as sf
 import structlog
+from numba import njit
+
+try:
+    import yaml
+except ImportError:  # pragma: no cover - pyyaml faz parte do requirements
+    yaml = None
+
+# Parser JSON em C quando disponível (json.loads também aceita bytes)
+try:
+    from orjson import loads as _json_loads
+except ImportError:  # pragma: no cover - orjson é opcional
+    _json_loads = json.loads
+
+if TYPE_CHECKING:
+    import onnxruntime as ort
 
 logger = structlog.get_logger()
 
+# Sessões ONNX Runtime reaproveitadas entre sínteses (o service é instanciado
+# por request; parse + otimização do grafo custa centenas de ms por modelo)
+_ORT_SESSIONS: dict[tuple[Path, int | None], "ort.InferenceSession"] = {}
+_ORT_SESSIONS_LOCK = threading.Lock()
+
+# Speaker embeddings já lidos, por (raiz do voicebank, speaker)
+_SPK_CACHE: dict[tuple[Path, str], np.ndarray] = {}
+
+# Tabela de seno para o vibrato do f0 de fallback (tamanho ajustável, potência
+# de 2): com 4096 entradas o erro a 5 Hz fica bem abaixo de 1 cent
+_SIN_LUT_SIZE = 4096
+_SIN_LUT = np.sin(
+    np.linspace(0.0, 2.0 * np.pi, _SIN_LUT_SIZE, endpoint=False)
+).astype(np.float32)
+
+# Buffers constantes (1, max_frames) por (dtype, valor), fatiados por síntese
+_CONST_FRAMES: dict[tuple[str, float], np.ndarray] = {}
+_CONST_FRAMES_LOCK = threading.Lock()
+_CONST_FRAMES_MAX_ENTRIES = 16
+
+# Índice de voicebanks por diretório, com a assinatura de mtimes do layout
+_VB_INDEX: dict[Path, tuple[tuple, dict]] = {}
+_VB_INDEX_LOCK = threading.Lock()
+
 # ─── Italian Grapheme-to-Phoneme (regras simplificadas) ───
 
+
+def _digraph_pattern(by_first: dict[str, list[tuple[str, tuple[str, ...]]]]) -> re.Pattern:
+    """Regex de dígrafos como trie de um nível, com fallback para um caractere.
+
+    Cada ramo é "primeira letra + (?:restos)", então numa posição o re só testa
+    os restos dos dígrafos que começam com aquela letra.
+    """
+    branches = []
+    for first, entries in by_first.items():
+        rests = sorted((g[1:] for g, _ in entries), key=len, reverse=True)
+        branches.append(re.escape(first) + "(?:" + "|".join(map(re.escape, rests)) + ")")
+    return re.compile("|".join(branches) + "|.", re.DOTALL)
+
+
 # Mapa de grafemas italianos → fonemas intermediários (dsdict-it style)
 _IT_DIGRAPHS = [
     ("gli", "LL i"),
@@ -68,40 +126,46 @@ _IT_REPLACEMENTS = {
 _LANG_PREFIX_MAP = {"en": 1, "es": 2, "ja": 3, "ko": 4, "pt": 5, "zh": 6}
 
 
+# Dígrafos e caracteres simples já expandidos por _IT_REPLACEMENTS no import
+# (dígrafos ordenados do mais longo para o mais curto, ordem do casamento)
+_IT_DIGRAPHS_EXPANDED: list[tuple[str, tuple[str, ...]]] = sorted(
+    (
+        (grapheme, tuple(_IT_REPLACEMENTS.get(ph, ph) for ph in intermediate.split() if ph))
+        for grapheme, intermediate in _IT_DIGRAPHS
+    ),
+    key=lambda x: -len(x[0]),
+)
+_IT_SINGLE_EXPANDED: dict[str, tuple[str, ...]] = {
+    ch: tuple(_IT_REPLACEMENTS[ph] for ph in intermediate.split() if ph in _IT_REPLACEMENTS)
+    for ch, intermediate in _IT_SINGLE.items()
+}
+
+# Grafema → fonemas finais (dígrafos têm prioridade sobre caracteres simples)
+_IT_RULES: dict[str, tuple[str, ...]] = {**_IT_SINGLE_EXPANDED, **dict(_IT_DIGRAPHS_EXPANDED)}
+
+# Dígrafos indexados pela primeira letra (trie de um nível)
+_IT_BY_FIRST: dict[str, list[tuple[str, tuple[str, ...]]]] = {}
+for _entry in _IT_DIGRAPHS_EXPANDED:
+    _IT_BY_FIRST.setdefault(_entry[0][0], []).append(_entry)
+
+# Dígrafos (mais longos primeiro) ou um caractere qualquer; o re casa em C
+_IT_PATTERN = _digraph_pattern(_IT_BY_FIRST)
+
+
 def _italian_g2p(text: str) -> list[str]:
     """Converte texto italiano para sequência de fonemas do modelo."""
     text = text.lower().strip()
     if not text:
         return ["SP"]
 
-    model_phonemes = []
-    i = 0
-    while i < len(text):
-        if not text[i].isalpha():
+    model_phonemes: list[str] = []
+    for grapheme in _IT_PATTERN.findall(text):
+        phs = _IT_RULES.get(grapheme)
+        if phs is not None:
+            model_phonemes.extend(phs)
+        elif not grapheme.isalpha():
             if model_phonemes and model_phonemes[-1] != "SP":
                 model_phonemes.append("SP")
-            i += 1
-            continue
-
-        matched = False
-        for grapheme, intermediate in _IT_DIGRAPHS:
-            if text[i:i + len(grapheme)] == grapheme:
-                for ph in intermediate.split():
-                    if ph in _IT_REPLACEMENTS:
-                        model_phonemes.append(_IT_REPLACEMENTS[ph])
-                    elif ph:
-                        model_phonemes.append(ph)
-                i += len(grapheme)
-                matched = True
-                break
-
-        if not matched:
-            ch = text[i]
-            intermediate = _IT_SINGLE.get(ch, "")
-            for ph in intermediate.split():
-                if ph in _IT_REPLACEMENTS:
-                    model_phonemes.append(_IT_REPLACEMENTS[ph])
-            i += 1
 
     return model_phonemes if model_phonemes else ["SP"]
 
@@ -152,6 +216,19 @@ _PT_SINGLE: dict[str, list[str]] = {
 }
 
 
+# Grafema → fonemas pt/ (dígrafos têm prioridade sobre caracteres simples)
+_PT_RULES: dict[str, tuple[str, ...]] = {ch: tuple(phs) for ch, phs in _PT_SINGLE.items()}
+_PT_RULES.update((g, tuple(phs)) for g, phs in _PT_DIGRAPHS)
+
+# Dígrafos indexados pela primeira letra: a maioria começa com a, e, o
+_PT_BY_FIRST: dict[str, list[tuple[str, tuple[str, ...]]]] = {}
+for _entry in _PT_DIGRAPHS:
+    _PT_BY_FIRST.setdefault(_entry[0][0], []).append((_entry[0], tuple(_entry[1])))
+del _entry
+
+_PT_PATTERN = _digraph_pattern(_PT_BY_FIRST)
+
+
 def _portuguese_g2p(text: str) -> list[str]:
     """Converte texto português para sequência de fonemas pt/ do modelo."""
     text = text.lower().strip()
@@ -162,28 +239,13 @@ def _portuguese_g2p(text: str) -> list[str]:
     text = text.replace("cao", "ção").replace("nao", "não")
 
     phonemes: list[str] = []
-    i = 0
-    while i < len(text):
-        if not text[i].isalpha() and text[i] not in "áàâãéêíóôõúç":
+    for grapheme in _PT_PATTERN.findall(text):
+        phs = _PT_RULES.get(grapheme)
+        if phs is not None:
+            phonemes.extend(phs)
+        elif not grapheme.isalpha():
             if phonemes and phonemes[-1] != "SP":
                 phonemes.append("SP")
-            i += 1
-            continue
-
-        # Tentar digrafos
-        matched = False
-        for grapheme, phs in _PT_DIGRAPHS:
-            if text[i:i + len(grapheme)] == grapheme:
-                phonemes.extend(phs)
-                i += len(grapheme)
-                matched = True
-                break
-
-        if not matched:
-            ch = text[i]
-            phs = _PT_SINGLE.get(ch, [])
-            phonemes.extend(phs)
-            i += 1
 
     return phonemes if phonemes else ["SP"]
 
@@ -199,6 +261,535 @@ def _g2p(text: str, language: str) -> list[str]:
         return _portuguese_g2p(text)
 
 
+@lru_cache(maxsize=4096)
+def _g2p_cached(text: str, language: str) -> tuple[str, ...]:
+    """G2P memoizado: letras se repetem muito numa música (refrões, melismas "a").
+
+    Os callers normalizam o texto (lower/strip) antes, para que variações de
+    caixa caiam na mesma entrada. Testes podem isolar via _g2p_cached.cache_clear().
+    """
+    return tuple(_g2p(text, language))
+
+
+@cache
+def _ort():
+    """Importa o onnxruntime (pesado) uma única vez, só quando há síntese real."""
+    import onnxruntime
+
+    return onnxruntime
+
+
+@cache
+def _register_shared_arena() -> None:
+    """Registra no ambiente do ORT uma arena de CPU única para todas as sessões."""
+    ort = _ort()
+    mem_info = ort.OrtMemoryInfo(
+        "Cpu", ort.OrtAllocatorType.ORT_ARENA_ALLOCATOR, 0, ort.OrtMemType.DEFAULT
+    )
+    ort.create_and_register_allocator(mem_info, ort.OrtArenaCfg(0, -1, -1, -1))
+
+
+def _ort_options(intra_op_threads: int | None = None) -> "ort.SessionOptions":
+    """SessionOptions ajustadas para rodar dentro do servidor async.
+
+    Por padrão metade dos cores (intra_op_threads sobrescreve por estágio)
+    evita oversubscription com outras requests, e a arena +
+    mem pattern reaproveitam as alocações entre execuções da mesma sessão.
+    A arena é única no ambiente (session.use_env_allocators): as sessões em
+    cache de um voicebank não retêm cada uma seu próprio pico de memória.
+    """
+    from config import settings
+
+    ort = _ort()
+    so = ort.SessionOptions()
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    so.intra_op_num_threads = intra_op_threads or max(1, (os.cpu_count() or 2) // 2)
+    so.enable_cpu_mem_arena = settings.diffsinger_mem_arena
+    so.enable_mem_pattern = True
+    so.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    so.add_session_config_entry("session.intra_op.allow_spinning", "1")
+    if settings.diffsinger_mem_arena:
+        _register_shared_arena()
+        so.add_session_config_entry("session.use_env_allocators", "1")
+    return so
+
+
+def _optimized_model_path(path: Path) -> Path:
+    """Path do grafo já otimizado (fusões do ORT) no cache em disco.
+
+    A chave inclui tamanho/mtime do modelo e a versão do ORT: o grafo otimizado
+    é específico do runtime e precisa ser refeito se o modelo mudar.
+    """
+    from config import settings
+
+    stat = path.stat()
+    digest = hashlib.blake2b(
+        f"{path}|{stat.st_size}|{stat.st_mtime_ns}|{_ort().__version__}".encode(),
+        digest_size=8,
+    ).hexdigest()
+    return settings.storage_path / "cache" / "diffsinger" / f"{path.stem}.{digest}.opt.onnx"
+
+
+def _create_session(path: Path, intra_op_threads: int | None) -> "ort.InferenceSession":
+    """Cria a sessão reaproveitando o grafo otimizado serializado em disco.
+
+    Na primeira vez o ORT otimiza e grava o grafo (optimized_model_filepath);
+    nas seguintes, inclusive em outros processos, o grafo fundido é carregado
+    sem repetir as otimizações.
+    """
+    ort = _ort()
+    providers = ["CPUExecutionProvider"]
+    opt_path = _optimized_model_path(path)
+
+    if opt_path.exists():
+        so = _ort_options(intra_op_threads)
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        try:
+            return ort.InferenceSession(str(opt_path), sess_options=so, providers=providers)
+        except Exception as e:
+            logger.warning("onnx_grafo_otimizado_invalido", path=str(opt_path), error=str(e))
+            opt_path.unlink(missing_ok=True)
+
+    so = _ort_options(intra_op_threads)
+    try:
+        opt_path.parent.mkdir(parents=True, exist_ok=True)
+        so.optimized_model_filepath = str(opt_path)
+    except OSError:
+        pass  # storage somente leitura: segue sem serializar
+    return ort.InferenceSession(str(path), sess_options=so, providers=providers)
+
+
+def _ort_session(
+    path: Path, intra_op_threads: int | None = None
+) -> "ort.InferenceSession":
+    """Retorna a InferenceSession do modelo, criando-a na primeira chamada.
+
+    O número de threads intra-op faz parte da chave do cache de sessões.
+    """
+    model = path.resolve()
+    key = (model, intra_op_threads)
+    with _ORT_SESSIONS_LOCK:
+        session = _ORT_SESSIONS.get(key)
+        if session is None:
+            session = _create_session(model, intra_op_threads)
+            _ORT_SESSIONS[key] = session
+            logger.info("onnx_sessao_criada", model=model.name, threads=intra_op_threads)
+    return session
+
+
+_PRECISIONS = ("fp32", "fp16", "int8")
+
+
+def _model_variant(path: Path, precision: str) -> Path:
+    """Variante quantizada do modelo (ex.: dur.int8.onnx), se existir ao lado do fp32."""
+    if precision == "fp32":
+        return path
+    candidate = path.with_name(f"{path.stem}.{precision}{path.suffix}")
+    return candidate if candidate.exists() else path
+
+
+# Entradas do acoustic que dependem só da melodia/config (etapas 2-4 do pipeline)
+_FEEDS_KEYS = ("tokens", "languages", "durations", "f0")
+_FEEDS_CACHE_VERSION = 1
+
+# Modelos cujas saídas entram no cache de feeds (mudá-los invalida a entrada)
+_FEEDS_MODEL_FILES = (
+    ("dsdur", "files", "linguistic.onnx"),
+    ("dsdur", "files", "dur.onnx"),
+    ("dspitch", "files", "linguistic.onnx"),
+    ("dspitch", "files", "pitch.onnx"),
+)
+
+
+def _feeds_cache_path(
+    notes: list[dict], config: "DiffSingerConfig", vb_root: Path, precision: str
+) -> Path:
+    """Path do .npz com tokens/languages/durations/f0 para esta melodia e config.
+
+    gender/energy só entram no acoustic e ficam fora da chave: mudar esses
+    sliders reaproveita as predições de duração e pitch.
+    """
+    from config import settings
+
+    stamps = []
+    for parts in _FEEDS_MODEL_FILES:
+        model = _model_variant(vb_root.joinpath(*parts), precision)
+        if model.exists():
+            stat = model.stat()
+            stamps.append((str(model), stat.st_size, stat.st_mtime_ns))
+    cfg = {
+        k: v for k, v in config.to_dict().items()
+        if k not in ("gender", "energy", "precision")
+    }
+    payload = json.dumps(
+        {
+            "v": _FEEDS_CACHE_VERSION,
+            "notes": notes,
+            "config": cfg,
+            "precision": precision,
+            "vb_root": str(vb_root),
+            "models": stamps,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    digest = hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+    return settings.storage_path / "cache" / "diffsinger" / "feeds" / f"{digest}.npz"
+
+
+def _load_feeds(path: Path) -> dict[str, np.ndarray] | None:
+    """Lê o .npz de feeds em cache; None se ausente ou corrompido."""
+    if not path.exists():
+        return None
+    try:
+        with np.load(path) as data:
+            features = {key: data[key] for key in _FEEDS_KEYS}
+        os.utime(path)  # marca como usado para a evicção LRU
+        return features
+    except (OSError, KeyError, ValueError) as e:
+        logger.warning("diffsinger_feeds_cache_invalido", path=path.name, error=str(e))
+        return None
+
+
+def _save_feeds(path: Path, features: dict[str, np.ndarray]) -> None:
+    """Grava os feeds em .npz (escrita atômica via arquivo temporário)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp.npz")
+    try:
+        np.savez(tmp, **{key: features[key] for key in _FEEDS_KEYS})
+        os.replace(tmp, path)
+    except OSError as e:
+        tmp.unlink(missing_ok=True)
+        logger.warning("diffsinger_feeds_cache_falhou", path=path.name, error=str(e))
+    else:
+        _evict_feeds_cache(path.parent)
+
+
+def _evict_feeds_cache(cache_dir: Path) -> None:
+    """Remove os .npz menos usados (mtime mais antigo) até caber no limite.
+
+    Cada edição de melodia, mudança de config ou reinstalação do voicebank gera
+    uma chave nova; as entradas que deixam de ser usadas saem primeiro.
+    """
+    from config import settings
+
+    max_bytes = settings.diffsinger_feeds_cache_max_mb * 1024 * 1024
+    entries = []
+    for path in cache_dir.glob("*.npz"):
+        if path.name.endswith(".tmp.npz"):
+            continue
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    if total <= max_bytes:
+        return
+    for _, size, path in sorted(entries, key=lambda e: e[0]):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+@lru_cache(maxsize=32)
+def _locate_models(vb_root: Path, root_mtime_ns: int) -> tuple[Path | None, Path | None]:
+    """Paths do acoustic e do vocoder do voicebank (None quando ausentes).
+
+    Layouts fora do padrão caem num rglob, feito uma vez por raiz: a mtime da
+    raiz na chave invalida a entrada quando o voicebank é reinstalado.
+    """
+    acoustic = vb_root / "dsmain" / "acoustic.onnx"
+    if not acoustic.exists():
+        acoustic = next(vb_root.rglob("acoustic.onnx"), None)
+
+    vocoder = vb_root / "dsvocoder" / "tgm_hifigan_v110.onnx"
+    if not vocoder.exists():
+        vocoder = next(
+            (
+                f for f in vb_root.rglob("*.onnx")
+                if ("vocoder" in f.name or "hifigan" in f.name)
+                and Path(f.stem).suffix.lstrip(".") not in _PRECISIONS
+            ),
+            None,
+        )
+    return acoustic, vocoder
+
+
+def _model_paths(vb_root: Path) -> tuple[Path | None, Path | None]:
+    """_locate_models com revalidação: path em cache que sumiu refaz a busca."""
+    paths = _locate_models(vb_root, vb_root.stat().st_mtime_ns)
+    if any(p is not None and not p.exists() for p in paths):
+        _locate_models.cache_clear()
+        paths = _locate_models(vb_root, vb_root.stat().st_mtime_ns)
+    return paths
+
+
+def _run_bound(
+    session: "ort.InferenceSession", feeds: dict[str, np.ndarray]
+) -> list[np.ndarray]:
+    """Executa a sessão via IOBinding: entradas ligadas direto dos buffers NumPy.
+
+    Evita a conversão de cada entrada feita por session.run. O IOBinding é
+    criado por chamada porque as sessões em cache são compartilhadas entre
+    threads, e o binding não é thread-safe. As saídas são alocadas pelo ORT
+    (shapes dinâmicos) e devolvidas na ordem de session.get_outputs(), como
+    arrays que apontam direto para o buffer do OrtValue (sem cópia; o array
+    mantém o buffer vivo).
+    """
+    io = session.io_binding()
+    for name, value in feeds.items():
+        io.bind_cpu_input(name, np.ascontiguousarray(value))
+    for output in session.get_outputs():
+        io.bind_output(output.name, "cpu")
+    session.run_with_iobinding(io)
+    return [value.numpy() for value in io.get_outputs()]
+
+
+# Vocoder em blocos de frames mel, com sobreposição e crossfade nas junções
+_VOCODER_CHUNK_FRAMES = 500
+_VOCODER_OVERLAP_FRAMES = 16
+
+
+def _vocode_chunked(
+    session: "ort.InferenceSession", mel: np.ndarray, f0: np.ndarray
+) -> np.ndarray:
+    """Roda o vocoder em blocos de _VOCODER_CHUNK_FRAMES frames e junta por overlap-add.
+
+    Mantém pequeno o working set do HiFi-GAN em músicas longas. Blocos vizinhos
+    dividem _VOCODER_OVERLAP_FRAMES frames, unidos com crossfade cosseno. As
+    amostras por frame são deduzidas da saída do primeiro bloco.
+    """
+    n_frames = mel.shape[1]
+    f0 = f0.reshape(1, -1)
+    if n_frames <= _VOCODER_CHUNK_FRAMES:
+        return _run_bound(session, {"mel": mel, "f0": f0})[0].reshape(-1)
+
+    step = _VOCODER_CHUNK_FRAMES - _VOCODER_OVERLAP_FRAMES
+    audio = None
+    for start in range(0, n_frames, step):
+        end = min(start + _VOCODER_CHUNK_FRAMES, n_frames)
+        wave = _run_bound(session, {
+            "mel": mel[:, start:end],
+            "f0": f0[:, start:end],
+        })[0].reshape(-1)
+
+        if audio is None:
+            spf = wave.shape[0] // (end - start)
+            audio = np.empty(n_frames * spf, dtype=np.float32)
+            fade_len = _VOCODER_OVERLAP_FRAMES * spf
+            fade_in = (0.5 - 0.5 * np.cos(np.linspace(0.0, np.pi, fade_len))).astype(np.float32)
+            audio[: wave.shape[0]] = wave
+        else:
+            pos = start * spf
+            wave = wave[: audio.shape[0] - pos]
+            n_fade = min(fade_len, wave.shape[0])
+            head = audio[pos : pos + n_fade]
+            head += (wave[:n_fade] - head) * fade_in[:n_fade]
+            audio[pos + n_fade : pos + wave.shape[0]] = wave[n_fade:]
+        if end == n_frames:
+            break
+    return audio
+
+
+def _write_wav(path: Path, audio: np.ndarray, sr: int) -> None:
+    """Grava o áudio mono em WAV PCM 16-bit.
+
+    PCM_16 é o padrão do libsndfile para WAV; fica explícito porque um FLOAT
+    dobraria o tamanho dos renders. O libsndfile converte o float32 em blocos
+    internos, sem cópia int16 do buffer inteiro.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    sf.write(str(path), audio, sr, subtype="PCM_16")
+
+
+def _const_frames(n_frames: int, fill: float, dtype) -> np.ndarray:
+    """View (1, n_frames) de um buffer constante reaproveitado entre sínteses.
+
+    O buffer só é realocado quando n_frames cresce. É somente leitura, então as
+    views podem ser compartilhadas entre threads sem cópia.
+    """
+    key = (np.dtype(dtype).str, float(fill))
+    with _CONST_FRAMES_LOCK:
+        buf = _CONST_FRAMES.get(key)
+        if buf is None or buf.shape[1] < n_frames:
+            if buf is None and len(_CONST_FRAMES) >= _CONST_FRAMES_MAX_ENTRIES:
+                _CONST_FRAMES.clear()  # valores de slider variam; mantém o cache pequeno
+            buf = np.full((1, n_frames), fill, dtype=dtype)
+            buf.flags.writeable = False
+            _CONST_FRAMES[key] = buf
+    return buf[:, :n_frames]
+
+
+@lru_cache(maxsize=8)
+def _mel_basis_inv(sr: int, n_fft: int, n_mels: int) -> np.ndarray:
+    """Pseudoinversa do banco de filtros mel, (1 + n_fft/2, n_mels), para o Griffin-Lim."""
+    import librosa
+
+    basis = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels)
+    inv = np.linalg.pinv(basis).astype(np.float32)
+    inv.flags.writeable = False
+    return inv
+
+
+def _broadcast_spk_embed(spk_embed_vec: np.ndarray, n: int) -> np.ndarray:
+    """Speaker embedding repetido em n posições, como view (1, n, dim) sem cópia.
+
+    A cópia contígua acontece uma única vez, ao ligar a entrada em _run_bound;
+    materializar o np.tile antes só duplicaria a cópia.
+    """
+    vec = spk_embed_vec.astype(np.float32, copy=False)
+    return np.broadcast_to(vec.reshape(1, 1, -1), (1, n, vec.shape[0]))
+
+
+@njit("void(float32[:], float64)", fastmath=True, cache=True)
+def _normalize_peak_kernel(audio: np.ndarray, target: float) -> None:
+    """Normaliza audio in-place para o pico target (não mexe em áudio silencioso).
+
+    Uma leitura para achar o pico e uma passada de leitura/escrita para escalar,
+    sem os temporários de abs, divisão e astype.
+    """
+    peak = 0.0
+    for i in range(audio.shape[0]):
+        peak = max(peak, abs(audio[i]))
+    if peak > 0.0:
+        gain = np.float32(target / peak)
+        for i in range(audio.shape[0]):
+            audio[i] *= gain
+
+
+@njit("void(float32[:], int64[:], int64[:], float64[:], int64, int64)", fastmath=True, cache=True)
+def _synth_notes_kernel(
+    audio: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    freqs: np.ndarray,
+    attack_max: int,
+    release_max: int,
+) -> None:
+    """Soma as notas do placeholder em audio (4 harmônicos + envelope, compilado com numba).
+
+    freqs vem em ciclos por amostra. Attack e release são limitados a 1/4 da nota.
+    Laço serial sobre as notas: notas sobrepostas escrevem nas mesmas amostras.
+    """
+    total = audio.shape[0]
+    for k in range(starts.shape[0]):
+        start = starts[k]
+        n = ends[k] - start
+        w = 2.0 * np.pi * freqs[k]
+        attack = min(attack_max, n // 4)
+        release = min(release_max, n // 4)
+        stop = min(n, total - start)
+        # Fasor girado por multiplicação complexa: sem sin/cos dentro do laço
+        cw = np.cos(w)
+        sw = np.sin(w)
+        s1 = 0.0
+        c1 = 1.0
+        for i in range(stop):
+            # Harmônicos por identidades de arco múltiplo
+            s2 = 2.0 * s1 * c1
+            c2 = 2.0 * c1 * c1 - 1.0
+            s3 = s2 * c1 + c2 * s1
+            s4 = 2.0 * s2 * c2
+            s = 0.5 * s1 + 0.25 * s2 + 0.12 * s3 + 0.06 * s4
+            if i < attack:
+                s *= i / (attack - 1) if attack > 1 else 0.0
+            if i >= n - release:
+                s *= 1.0 - (i - (n - release)) / (release - 1) if release > 1 else 1.0
+            audio[start + i] += np.float32(0.3 * s)
+            s1, c1 = s1 * cw + c1 * sw, c1 * cw - s1 * sw
+
+
+@njit("int64[:](float64[:], float64[:])", cache=True)
+def _resolve_overlaps_kernel(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Índices das notas mantidas após resolver overlaps (entrada ordenada por início).
+
+    Nota que começa antes do fim da última mantida a substitui se for mais longa;
+    senão é descartada.
+    """
+    keep = np.empty(starts.shape[0], dtype=np.int64)
+    k = 0
+    for i in range(starts.shape[0]):
+        if k > 0 and starts[i] < ends[keep[k - 1]]:
+            last = keep[k - 1]
+            if ends[i] - starts[i] > ends[last] - starts[last]:
+                keep[k - 1] = i
+        else:
+            keep[k] = i
+            k += 1
+    return keep[:k]
+
+
+# Fonemas tratados como vogais na divisão de durações do fallback
+_VOWEL_PHONEMES = frozenset({
+    "pt/a", "pt/e", "pt/eh", "pt/i", "pt/o", "pt/oh", "pt/u",
+    "pt/ax", "pt/ae", "pt/an", "pt/en", "pt/in", "pt/on", "pt/un",
+    "pt/i0", "pt/u0",
+    "es/a", "es/e", "es/i", "es/o", "es/u",
+    "SP", "AP",
+})
+
+
+def _vowel_id_table(phoneme_map: dict[str, int], max_token: int = 0) -> np.ndarray:
+    """Tabela token_id → é vogal, para indexar direto com o array de tokens."""
+    size = max(max(phoneme_map.values(), default=0), max_token) + 1
+    table = np.zeros(size, dtype=np.bool_)
+    for ph in _VOWEL_PHONEMES:
+        token_id = phoneme_map.get(ph)
+        if token_id is not None:
+            table[token_id] = True
+    return table
+
+
+@njit("int64[:](int64[:], int64[:], int64[:], boolean[:])", cache=True)
+def _estimate_durations_kernel(
+    tokens: np.ndarray,
+    word_div: np.ndarray,
+    word_dur: np.ndarray,
+    is_vowel: np.ndarray,
+) -> np.ndarray:
+    """Distribui os frames de cada palavra entre os fonemas (compilado com numba).
+
+    Consoantes recebem 8% da palavra (mínimo 2 frames), vogais dividem o resto
+    e o último fonema absorve a diferença de arredondamento.
+    """
+    durations = np.ones(tokens.shape[0], dtype=np.int64)
+    ph_idx = 0
+
+    for w in range(word_div.shape[0]):
+        n_ph = word_div[w]
+        w_frames = word_dur[w]
+
+        if n_ph == 1:
+            durations[ph_idx] = max(w_frames, 1)
+        else:
+            n_vow = 0
+            for p in range(n_ph):
+                if is_vowel[ph_idx + p]:
+                    n_vow += 1
+            n_cons = n_ph - n_vow
+
+            cons_frames = max(int(w_frames * 0.08), 2) if n_cons > 0 else 0
+            remaining = max(w_frames - cons_frames * n_cons, 1)
+            vow_frames = max(remaining // max(n_vow, 1), 1) if n_vow > 0 else 1
+
+            total = 0
+            for p in range(n_ph):
+                d = vow_frames if is_vowel[ph_idx + p] else cons_frames
+                durations[ph_idx + p] = d
+                total += d
+
+            # Ajustar resto
+            diff = w_frames - total
+            if diff != 0:
+                durations[ph_idx + n_ph - 1] = max(durations[ph_idx + n_ph - 1] + diff, 1)
+
+        ph_idx += n_ph
+
+    return durations
+
+
 def _get_lang_id_for_config(language: str) -> int:
     """Retorna language ID consistente baseado no idioma do projeto."""
     _CONFIG_LANG_MAP = {
@@ -229,6 +820,7 @@ class DiffSingerConfig:
         sample_rate: int = 44100,
         speaker: str = "",
         diffusion_steps: int = 50,
+        precision: str | None = None,
     ):
         self.voicebank = voicebank
         self.language = language
@@ -241,6 +833,8 @@ class DiffSingerConfig:
         self.sample_rate = sample_rate
         self.speaker = speaker
         self.diffusion_steps = diffusion_steps
+        # None → settings.diffsinger_precision
+        self.precision = precision
 
     def to_dict(self) -> dict:
         return {
@@ -255,6 +849,7 @@ class DiffSingerConfig:
             "sample_rate": self.sample_rate,
             "speaker": self.speaker,
             "diffusion_steps": self.diffusion_steps,
+            "precision": self.precision,
         }
 
     @classmethod
@@ -262,7 +857,7 @@ class DiffSingerConfig:
         valid_keys = {
             "voicebank", "language", "breathiness", "tension", "energy",
             "voicing", "pitch_deviation", "gender", "sample_rate", "speaker",
-            "diffusion_steps",
+            "diffusion_steps", "precision",
         }
         return cls(**{k: v for k, v in data.items() if k in valid_keys})
 
@@ -277,29 +872,60 @@ class DiffSingerService:
 
     def is_available(self) -> bool:
         """Verifica se há voicebanks DiffSinger instalados."""
-        if not self.voicebanks_path.exists():
-            return False
-        for lang_dir in self.voicebanks_path.iterdir():
-            if not lang_dir.is_dir():
-                continue
-            for vb_dir in lang_dir.iterdir():
-                if not vb_dir.is_dir():
-                    continue
-                if list(vb_dir.rglob("acoustic.onnx")):
-                    return True
-        return False
+        return self._voicebank_index()["available"]
 
     def list_voicebanks(self) -> list[dict]:
         """Lista voicebanks disponíveis."""
-        voicebanks = []
+        return [dict(vb) for vb in self._voicebank_index()["voicebanks"]]
+
+    def _layout_signature(self) -> tuple:
+        """mtimes da raiz, dos diretórios de idioma e de cada voicebank.
+
+        Instalar/remover um voicebank altera a mtime do diretório pai, então
+        dois iterdir() bastam para invalidar o índice sem rglob.
+        """
+        sig: list = [self.voicebanks_path.stat().st_mtime_ns]
+        for lang_dir in sorted(self.voicebanks_path.iterdir()):
+            if not lang_dir.is_dir():
+                continue
+            sig.append((lang_dir.name, lang_dir.stat().st_mtime_ns))
+            for vb_dir in sorted(lang_dir.iterdir()):
+                if vb_dir.is_dir():
+                    sig.append((lang_dir.name, vb_dir.name, vb_dir.stat().st_mtime_ns))
+        return tuple(sig)
+
+    def _voicebank_index(self) -> dict:
+        """Índice dos voicebanks, reaproveitado enquanto o layout não mudar."""
         if not self.voicebanks_path.exists():
-            return voicebanks
+            return {"voicebanks": [], "roots": [], "available": False}
+
+        sig = self._layout_signature()
+        with _VB_INDEX_LOCK:
+            cached = _VB_INDEX.get(self.voicebanks_path)
+        if cached is not None and cached[0] == sig:
+            return cached[1]
+
+        index = self._scan_voicebanks()
+        with _VB_INDEX_LOCK:
+            _VB_INDEX[self.voicebanks_path] = (sig, index)
+        logger.info("voicebanks_indexados", total=len(index["voicebanks"]))
+        return index
+
+    def _scan_voicebanks(self) -> dict:
+        """Varre o disco: voicebanks com dsconfig.yaml, raiz de cada um e disponibilidade."""
+        voicebanks = []
+        roots = []
+        available = False
 
         for lang_dir in self.voicebanks_path.iterdir():
-            if not lang_dir.is_dir() or lang_dir.name.startswith("."):
+            if not lang_dir.is_dir():
                 continue
             for vb_dir in lang_dir.iterdir():
-                if not vb_dir.is_dir() or vb_dir.name.startswith("."):
+                if not vb_dir.is_dir():
+                    continue
+                if not available and next(vb_dir.rglob("acoustic.onnx"), None):
+                    available = True
+                if lang_dir.name.startswith(".") or vb_dir.name.startswith("."):
                     continue
 
                 configs = list(vb_dir.rglob("dsconfig.yaml"))
@@ -310,13 +936,13 @@ class DiffSingerService:
                 model_dir = config_path.parent
 
                 speakers = []
-                try:
-                    import yaml
-                    with open(config_path) as f:
-                        ds_cfg = yaml.safe_load(f)
-                    speakers = ds_cfg.get("speakers", [])
-                except Exception:
-                    pass
+                if yaml is not None:
+                    try:
+                        with open(config_path) as f:
+                            ds_cfg = yaml.safe_load(f)
+                        speakers = ds_cfg.get("speakers", [])
+                    except Exception:
+                        pass
 
                 has_onnx = bool(list(model_dir.rglob("acoustic.onnx")))
 
@@ -328,29 +954,36 @@ class DiffSingerService:
                     "speakers": speakers,
                     "config_path": str(config_path),
                 })
-        return voicebanks
+                roots.append(self._resolve_voicebank_root(model_dir))
+
+        return {"voicebanks": voicebanks, "roots": roots, "available": available}
+
+    @staticmethod
+    def _resolve_voicebank_root(vb_path: Path) -> Path:
+        """Raiz do voicebank (diretório que contém dsmain/)."""
+        # Subir até encontrar o diretório que contém dsmain/
+        for candidate in [vb_path, vb_path.parent, vb_path.parent.parent]:
+            if (candidate / "dsmain").exists():
+                return candidate
+        # Buscar dsmain/ dentro do path
+        dsmain_dirs = list(vb_path.rglob("dsmain"))
+        if dsmain_dirs:
+            return dsmain_dirs[0].parent
+        return vb_path
 
     def _find_voicebank(self, name: str) -> Path | None:
         """Encontra o diretório de um voicebank pelo nome."""
-        for vb in self.list_voicebanks():
+        for vb in self._voicebank_index()["voicebanks"]:
             if vb["name"].lower() == name.lower() or name.lower() in vb["name"].lower():
                 return Path(vb["path"])
         return None
 
     def _find_voicebank_root(self, name: str) -> Path | None:
         """Encontra a raiz do voicebank (diretório que contém dsmain/)."""
-        for vb in self.list_voicebanks():
+        index = self._voicebank_index()
+        for vb, root in zip(index["voicebanks"], index["roots"]):
             if vb["name"].lower() == name.lower() or name.lower() in vb["name"].lower():
-                vb_path = Path(vb["path"])
-                # Subir até encontrar o diretório que contém dsmain/
-                for candidate in [vb_path, vb_path.parent, vb_path.parent.parent]:
-                    if (candidate / "dsmain").exists():
-                        return candidate
-                # Buscar dsmain/ dentro do path
-                dsmain_dirs = list(vb_path.rglob("dsmain"))
-                if dsmain_dirs:
-                    return dsmain_dirs[0].parent
-                return vb_path
+                return root
         return None
 
     async def synthesize(
@@ -379,8 +1012,7 @@ class DiffSingerService:
             language=config.language,
         )
 
-        with open(melody_json_path) as f:
-            melody_data = json.load(f)
+        melody_data = _json_loads(Path(melody_json_path).read_bytes())
 
         notes = melody_data.get("notes", [])
         if not notes:
@@ -393,6 +1025,15 @@ class DiffSingerService:
         bpm = melody_data.get("bpm", 120.0)
         notes = self._preprocess_notes(notes, bpm=bpm)
 
+        # Preview: cortar a nota que atravessa o fim da janela, para o pipeline
+        # (custo ∝ n_frames × steps de difusão) não sintetizar além do necessário
+        if preview_seconds:
+            notes = [
+                n if n["end_time"] <= preview_seconds else {**n, "end_time": preview_seconds}
+                for n in notes
+                if n["start_time"] < preview_seconds
+            ]
+
         vb_root = self._find_voicebank_root(config.voicebank)
         if vb_root:
             try:
@@ -420,27 +1061,20 @@ class DiffSingerService:
             com_letra=n_with_lyrics,
         )
 
+        # Intervalos em arrays float64 (SoA) para filtrar/ordenar em NumPy
+        starts = np.fromiter((n["start_time"] for n in base_notes), np.float64, len(base_notes))
+        ends = np.fromiter((n["end_time"] for n in base_notes), np.float64, len(base_notes))
+
         # 1. Filtrar notas muito curtas (< 100ms)
-        base_notes = [
-            n for n in base_notes
-            if (n["end_time"] - n["start_time"]) >= 0.1
-        ]
+        kept = np.flatnonzero((ends - starts) >= 0.1)
 
-        if not base_notes:
+        if kept.size == 0:
             return notes[:50]
 
-        # 2. Ordenar e resolver overlaps
-        base_notes.sort(key=lambda n: n["start_time"])
-        merged = []
-        for note in base_notes:
-            if merged and note["start_time"] < merged[-1]["end_time"]:
-                # Overlap — manter a mais longa
-                if (note["end_time"] - note["start_time"]) > (
-                    merged[-1]["end_time"] - merged[-1]["start_time"]
-                ):
-                    merged[-1] = note
-            else:
-                merged.append(note)
+        # 2. Ordenar (estável, como list.sort) e resolver overlaps
+        order = kept[np.argsort(starts[kept], kind="stable")]
+        merged_idx = order[_resolve_overlaps_kernel(starts[order], ends[order])]
+        merged = [base_notes[i] for i in merged_idx]
 
         # 3. Atribuir sílaba "a" para notas sem letra (melisma)
         for idx, note in enumerate(merged):
@@ -464,12 +1098,19 @@ class DiffSingerService:
             vb_root / "dsdur" / "files" / "phonemes.json",
         ]:
             if path.exists():
-                with open(path) as f:
-                    return json.load(f)
+                return _json_loads(path.read_bytes())
         raise FileNotFoundError(f"phonemes.json não encontrado em {vb_root}")
 
     def _load_speaker_embed(self, vb_root: Path, speaker: str = "") -> np.ndarray:
-        """Carrega speaker embedding do voicebank."""
+        """Carrega speaker embedding do voicebank (em cache por voicebank + speaker).
+
+        O array retornado é somente leitura e compartilhado entre sínteses.
+        """
+        key = (vb_root, speaker)
+        cached = _SPK_CACHE.get(key)
+        if cached is not None:
+            return cached
+
         # Buscar em vários diretórios possíveis
         search_dirs = [
             vb_root / "dsdur" / "embeds",
@@ -485,7 +1126,10 @@ class DiffSingerService:
                     break
 
         if not emb_files:
-            return np.zeros(384, dtype=np.float32)
+            data = np.zeros(384, dtype=np.float32)
+            data.flags.writeable = False
+            _SPK_CACHE[key] = data
+            return data
 
         target_file = emb_files[0]
         if speaker:
@@ -494,7 +1138,15 @@ class DiffSingerService:
                     target_file = ef
                     break
 
-        data = np.fromfile(str(target_file), dtype=np.float32)
+        # Cópia única a partir do mmap; a referência ao arquivo é liberada em seguida
+        if target_file.stat().st_size == 0:
+            data = np.zeros(0, dtype=np.float32)  # np.memmap não aceita arquivo vazio
+        else:
+            mapped = np.memmap(target_file, dtype=np.float32, mode="r")
+            data = np.array(mapped)
+            del mapped
+        data.flags.writeable = False
+        _SPK_CACHE[key] = data
         logger.info("speaker_embed_carregado", file=target_file.name, shape=data.shape)
         return data
 
@@ -524,94 +1176,97 @@ class DiffSingerService:
         ap_id = phoneme_map.get("AP", 1)
 
         fps = sr / hop_size
+        default_phonemes = ("pt/a",) if language == "pt" else ("es/a",)
 
-        tokens_list: list[int] = []
-        langs_list: list[int] = []
-        ph_midi_list: list[int] = []
-        word_div_list: list[int] = []
-        word_dur_list: list[int] = []
-        note_midi_list: list[float] = []
-        note_rest_list: list[bool] = []
+        # 1ª passada: fonemas de cada nota, para dimensionar os buffers
+        note_phonemes: list[tuple[str, ...]] = []
+        for note in notes:
+            lyric = (note.get("lyric", "") or "a").strip()
+            if not lyric:
+                lyric = "a"
+            phonemes = _g2p_cached(lyric.lower(), language)
+            if not phonemes or phonemes == ("SP",):
+                phonemes = default_phonemes
+            note_phonemes.append(phonemes)
+
+        # Limites superiores: SP inicial/final + (gap + fonemas) por nota
+        max_tokens = sum(len(phs) for phs in note_phonemes) + len(notes) + 2
+        max_words = 2 * len(notes) + 2
+
+        tokens = np.empty(max_tokens, dtype=np.int64)
+        ph_midi = np.empty(max_tokens, dtype=np.int64)
+        word_div = np.empty(max_words, dtype=np.int64)
+        word_dur = np.empty(max_words, dtype=np.int64)
+        note_midi = np.empty(max_words, dtype=np.float32)
+        note_rest = np.empty(max_words, dtype=bool)
+        t_idx = 0
+        w_idx = 0
 
         # SP inicial antes da primeira nota
         first_start = notes[0]["start_time"] if notes else 0.0
         initial_frames = max(int(first_start * fps), 1)
-        tokens_list.append(sp_id)
-        langs_list.append(lang_id)
-        ph_midi_list.append(0)
-        word_div_list.append(1)
-        word_dur_list.append(initial_frames)
-        note_midi_list.append(0.0)
-        note_rest_list.append(True)
+        tokens[t_idx] = sp_id
+        ph_midi[t_idx] = 0
+        t_idx += 1
+        word_div[w_idx] = 1
+        word_dur[w_idx] = initial_frames
+        note_midi[w_idx] = 0.0
+        note_rest[w_idx] = True
+        w_idx += 1
 
         prev_end = first_start
 
-        for note in notes:
+        for note, phonemes in zip(notes, note_phonemes):
             start_time = note["start_time"]
             end_time = note["end_time"]
             midi = note["midi_note"]
 
-            # Gap entre notas → SP ou AP
+            # Gap entre notas → SP (> 20ms, silêncio) ou AP (5-20ms, respiração)
             gap = start_time - prev_end
-            if gap > 0.02:  # > 20ms gap → silence
-                gap_frames = max(int(gap * fps), 1)
-                tokens_list.append(sp_id)
-                langs_list.append(lang_id)
-                ph_midi_list.append(0)
-                word_div_list.append(1)
-                word_dur_list.append(gap_frames)
-                note_midi_list.append(0.0)
-                note_rest_list.append(True)
-            elif gap > 0.005:  # 5-20ms → breath
-                gap_frames = max(int(gap * fps), 1)
-                tokens_list.append(ap_id)
-                langs_list.append(lang_id)
-                ph_midi_list.append(0)
-                word_div_list.append(1)
-                word_dur_list.append(gap_frames)
-                note_midi_list.append(0.0)
-                note_rest_list.append(True)
+            if gap > 0.005:
+                tokens[t_idx] = sp_id if gap > 0.02 else ap_id
+                ph_midi[t_idx] = 0
+                t_idx += 1
+                word_div[w_idx] = 1
+                word_dur[w_idx] = max(int(gap * fps), 1)
+                note_midi[w_idx] = 0.0
+                note_rest[w_idx] = True
+                w_idx += 1
 
             # Fonemas da nota
-            lyric = (note.get("lyric", "") or "a").strip()
-            if not lyric:
-                lyric = "a"
-            phonemes = _g2p(lyric, language)
-            if not phonemes or phonemes == ["SP"]:
-                phonemes = ["pt/a"] if language == "pt" else ["es/a"]
-
-            note_frames = max(int((end_time - start_time) * fps), 1)
-
+            n_ph = len(phonemes)
             for ph in phonemes:
-                token_id = phoneme_map.get(ph, sp_id)
-                tokens_list.append(token_id)
-                langs_list.append(lang_id)
-                ph_midi_list.append(midi)
+                tokens[t_idx] = phoneme_map.get(ph, sp_id)
+                t_idx += 1
+            ph_midi[t_idx - n_ph:t_idx] = midi
 
-            word_div_list.append(len(phonemes))
-            word_dur_list.append(note_frames)
-            note_midi_list.append(float(midi))
-            note_rest_list.append(False)
+            word_div[w_idx] = n_ph
+            word_dur[w_idx] = max(int((end_time - start_time) * fps), 1)
+            note_midi[w_idx] = midi
+            note_rest[w_idx] = False
+            w_idx += 1
 
             prev_end = end_time
 
         # SP final
-        tokens_list.append(sp_id)
-        langs_list.append(lang_id)
-        ph_midi_list.append(0)
-        word_div_list.append(1)
-        word_dur_list.append(1)
-        note_midi_list.append(0.0)
-        note_rest_list.append(True)
-
+        tokens[t_idx] = sp_id
+        ph_midi[t_idx] = 0
+        t_idx += 1
+        word_div[w_idx] = 1
+        word_dur[w_idx] = 1
+        note_midi[w_idx] = 0.0
+        note_rest[w_idx] = True
+        w_idx += 1
+
+        # Views dos trechos preenchidos (sem cópia); idioma é constante
         return {
-            "tokens": np.array(tokens_list, dtype=np.int64),
-            "languages": np.array(langs_list, dtype=np.int64),
-            "ph_midi": np.array(ph_midi_list, dtype=np.int64),
-            "word_div": np.array(word_div_list, dtype=np.int64),
-            "word_dur": np.array(word_dur_list, dtype=np.int64),
-            "note_midi": np.array(note_midi_list, dtype=np.float32),
-            "note_rest": np.array(note_rest_list, dtype=bool),
+            "tokens": tokens[:t_idx],
+            "languages": np.full(t_idx, lang_id, dtype=np.int64),
+            "ph_midi": ph_midi[:t_idx],
+            "word_div": word_div[:w_idx],
+            "word_dur": word_dur[:w_idx],
+            "note_midi": note_midi[:w_idx],
+            "note_rest": note_rest[:w_idx],
         }
 
     def _estimate_durations_fallback(
@@ -625,51 +1280,14 @@ class DiffSingerService:
 
         Usado quando os modelos de duração (dur.onnx) não estão disponíveis.
         """
-        id_to_ph = {v: k for k, v in phoneme_map.items()}
-        vowel_set = {
-            "pt/a", "pt/e", "pt/eh", "pt/i", "pt/o", "pt/oh", "pt/u",
-            "pt/ax", "pt/ae", "pt/an", "pt/en", "pt/in", "pt/on", "pt/un",
-            "pt/i0", "pt/u0",
-            "es/a", "es/e", "es/i", "es/o", "es/u",
-            "SP", "AP",
-        }
+        is_vowel = _vowel_id_table(phoneme_map, int(tokens.max(initial=0)))[tokens]
 
-        durations = np.ones(len(tokens), dtype=np.int64)
-        ph_idx = 0
-
-        for w in range(len(word_div)):
-            n_ph = int(word_div[w])
-            w_frames = int(word_dur[w])
-
-            if n_ph == 1:
-                durations[ph_idx] = max(w_frames, 1)
-            else:
-                is_vowel = []
-                for p in range(n_ph):
-                    ph_name = id_to_ph.get(int(tokens[ph_idx + p]), "")
-                    is_vowel.append(ph_name in vowel_set)
-
-                n_vow = sum(is_vowel)
-                n_cons = n_ph - n_vow
-
-                cons_frames = max(int(w_frames * 0.08), 2) if n_cons > 0 else 0
-                remaining = max(w_frames - cons_frames * n_cons, 1)
-                vow_frames = max(remaining // max(n_vow, 1), 1) if n_vow > 0 else 1
-
-                for p in range(n_ph):
-                    durations[ph_idx + p] = vow_frames if is_vowel[p] else cons_frames
-
-                # Ajustar resto
-                total = int(durations[ph_idx:ph_idx + n_ph].sum())
-                diff = w_frames - total
-                if diff != 0:
-                    durations[ph_idx + n_ph - 1] = max(
-                        int(durations[ph_idx + n_ph - 1]) + diff, 1
-                    )
-
-            ph_idx += n_ph
-
-        return durations
+        return _estimate_durations_kernel(
+            np.ascontiguousarray(tokens, dtype=np.int64),
+            np.ascontiguousarray(word_div, dtype=np.int64),
+            np.ascontiguousarray(word_dur, dtype=np.int64),
+            is_vowel,
+        )
 
     def _estimate_f0_fallback(
         self,
@@ -678,31 +1296,36 @@ class DiffSingerService:
         sr: int,
         hop_size: int,
     ) -> np.ndarray:
-        """Estima f0 a partir de notas MIDI (fallback sem pitch predictor)."""
+        """Estima f0 a partir de notas MIDI (fallback sem pitch predictor).
+
+        Vetorizado: cada frame conhece o índice do seu fonema via np.repeat, e
+        o vibrato é aplicado só nos frames elegíveis.
+        """
+        durations = np.asarray(durations, dtype=np.int64)
+        ph_midi = np.asarray(ph_midi, dtype=np.int64)
         n_frames = int(durations.sum())
-        f0 = np.zeros(n_frames, dtype=np.float32)
         fps = sr / hop_size
 
-        frame_idx = 0
-        for i in range(len(ph_midi)):
-            dur = int(durations[i])
-            midi = int(ph_midi[i])
-            if midi > 0 and dur > 0:
-                freq = 440.0 * (2.0 ** ((midi - 69) / 12.0))
-                segment = np.full(dur, freq, dtype=np.float32)
-
-                # Vibrato simples após 40% da nota
-                vib_start = int(dur * 0.4)
-                if vib_start < dur and dur > int(0.2 * fps):
-                    t = np.arange(dur - vib_start, dtype=np.float32) / fps
-                    depth = freq * (2 ** (15 / 1200) - 1)
-                    ramp = np.minimum(t / 0.4, 1.0)
-                    segment[vib_start:] += depth * ramp * np.sin(2 * np.pi * 5.0 * t)
-
-                end_idx = min(frame_idx + dur, n_frames)
-                f0[frame_idx:end_idx] = segment[:end_idx - frame_idx]
-
-            frame_idx += dur
+        # Frequência base por fonema (0 Hz em pausas)
+        voiced = ph_midi > 0
+        freqs = np.where(voiced, 440.0 * np.exp2((ph_midi - 69) / 12.0), 0.0)
+
+        note_idx = np.repeat(np.arange(len(ph_midi)), durations)
+        f0 = freqs[note_idx].astype(np.float32)
+
+        # Vibrato simples após 40% da nota, em notas mais longas que 200ms
+        vib_start = (durations * 0.4).astype(np.int64)
+        has_vib = voiced & (durations > int(0.2 * fps)) & (vib_start < durations)
+        if has_vib.any():
+            starts = np.cumsum(durations) - durations
+            local = np.arange(n_frames) - starts[note_idx]
+            vib_mask = has_vib[note_idx] & (local >= vib_start[note_idx])
+            frames = np.flatnonzero(vib_mask)
+            t = ((local[frames] - vib_start[note_idx[frames]]) / fps).astype(np.float32)
+            depth = freqs[note_idx[frames]] * (2 ** (15 / 1200) - 1)
+            ramp = np.minimum(t / 0.4, 1.0)
+            lut_idx = (t * (5.0 * _SIN_LUT_SIZE)).astype(np.int32) & (_SIN_LUT_SIZE - 1)
+            f0[frames] += (depth * ramp * _SIN_LUT[lut_idx]).astype(np.float32)
 
         return f0
 
@@ -721,8 +1344,6 @@ class DiffSingerService:
         Usa os modelos de duração e pitch do voicebank quando disponíveis,
         produzindo durações e f0 que o modelo acústico espera (treinados juntos).
         """
-        import onnxruntime as ort
-
         sr = config.sample_rate
         hop_size = 512
 
@@ -730,12 +1351,125 @@ class DiffSingerService:
         phoneme_map = self._load_phoneme_map(vb_root)
         spk_embed_vec = self._load_speaker_embed(vb_root, config.speaker)
 
+        from config import settings
+
+        precision = config.precision or settings.diffsinger_precision
+        if precision not in _PRECISIONS:
+            logger.warning("diffsinger_precisao_invalida", precision=precision)
+            precision = "fp32"
+
         logger.info(
             "voicebank_carregado",
             phonemes=len(phoneme_map),
             spk_dim=spk_embed_vec.shape[0],
+            precision=precision,
+        )
+
+        # ── 2-4. Sequências, durações e f0 (cache em disco por melodia/config) ──
+        feeds_path = _feeds_cache_path(notes, config, vb_root, precision)
+        features = _load_feeds(feeds_path)
+        if features is None:
+            features = self._predict_features(
+                notes, config, vb_root, precision,
+                phoneme_map, spk_embed_vec, preview_seconds,
+            )
+            _save_feeds(feeds_path, features)
+        else:
+            logger.info("diffsinger_feeds_cache_hit", path=feeds_path.name)
+
+        tokens = features["tokens"]
+        languages = features["languages"]
+        durations = features["durations"]
+        f0 = features["f0"]
+        n_tokens = len(tokens)
+        n_frames = int(durations.sum())
+
+        spk_frames = features.get("spk_frames")
+        if spk_frames is None:
+            spk_frames = np.ascontiguousarray(_broadcast_spk_embed(spk_embed_vec, n_frames))
+
+        # ── 5. Modelo acústico → mel spectrogram ──
+        acoustic_path, vocoder_path = _model_paths(vb_root)
+        if acoustic_path is None:
+            raise FileNotFoundError(
+                f"acoustic.onnx não encontrado em {vb_root}"
+            )
+
+        logger.info("acoustic_model_carregando", path=str(acoustic_path))
+        # Difusão do acoustic domina o tempo da síntese: usa todos os cores.
+        # O vocoder e os modelos menores ficam no padrão (metade dos cores)
+        acoustic = _ort_session(
+            _model_variant(acoustic_path, precision), intra_op_threads=os.cpu_count() or 1
         )
 
+        gender = _const_frames(n_frames, config.gender, np.float32)
+        velocity = _const_frames(n_frames, config.energy, np.float32)
+
+        acoustic_feeds = {
+            "tokens": tokens.reshape(1, -1),
+            "languages": languages.reshape(1, -1),
+            "durations": durations.reshape(1, -1),
+            "f0": f0.reshape(1, -1),
+            "gender": gender,
+            "velocity": velocity,
+            "spk_embed": spk_frames,
+            "steps": np.array(config.diffusion_steps, dtype=np.int64),
+        }
+
+        logger.info(
+            "acoustic_inference_iniciando",
+            n_tokens=n_tokens,
+            n_frames=n_frames,
+            steps=config.diffusion_steps,
+            shapes={k: v.shape for k, v in acoustic_feeds.items()},
+        )
+
+        mel_output = _run_bound(acoustic, acoustic_feeds)[0]  # (1, n_frames, 128)
+        logger.info("acoustic_inference_concluida", mel_shape=mel_output.shape)
+
+        # ── 6. Vocoder → waveform ──
+        if vocoder_path is not None:
+            logger.info("vocoder_carregando", path=str(vocoder_path))
+            vocoder = _ort_session(_model_variant(vocoder_path, precision))
+
+            audio = _vocode_chunked(vocoder, mel_output, f0).astype(np.float32, copy=False)
+            logger.info("vocoder_concluido", samples=len(audio))
+        else:
+            logger.warning("vocoder_nao_encontrado_usando_griffin_lim")
+            audio = self._mel_to_audio(mel_output.squeeze(), sr, hop_size)
+
+        # ── 7. Normalizar e salvar ──
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        _normalize_peak_kernel(audio, 0.85)
+
+        _write_wav(output_path, audio, sr)
+
+        logger.info(
+            "diffsinger_pipeline_concluido",
+            output=str(output_path),
+            duration=len(audio) / sr,
+        )
+        return output_path
+
+    def _predict_features(
+        self,
+        notes: list[dict],
+        config: DiffSingerConfig,
+        vb_root: Path,
+        precision: str,
+        phoneme_map: dict[str, int],
+        spk_embed_vec: np.ndarray,
+        preview_seconds: float | None,
+    ) -> dict[str, np.ndarray]:
+        """Etapas 2-4 do pipeline: sequências de fonemas, durações e f0.
+
+        Devolve as entradas do modelo acústico que dependem só da melodia e da
+        config (tokens, languages, durations, f0), mais o spk_frames já
+        materializado para o acoustic reaproveitar.
+        """
+        sr = config.sample_rate
+        hop_size = 512
+
         # ── 2. Preparar sequências ──
         seq = self._prepare_sequence_data(
             notes, phoneme_map, sr, hop_size, config.language
@@ -765,15 +1499,11 @@ class DiffSingerService:
         if ling_dur_path.exists() and dur_model_path.exists():
             logger.info("usando_modelos_duracao")
 
-            ling_dur = ort.InferenceSession(
-                str(ling_dur_path), providers=["CPUExecutionProvider"]
-            )
-            dur_model = ort.InferenceSession(
-                str(dur_model_path), providers=["CPUExecutionProvider"]
-            )
+            ling_dur = _ort_session(_model_variant(ling_dur_path, precision))
+            dur_model = _ort_session(_model_variant(dur_model_path, precision))
 
             # Linguistic encoder (dur): tokens + languages + word_div + word_dur
-            ling_dur_out = ling_dur.run(None, {
+            ling_dur_out = _run_bound(ling_dur, {
                 "tokens": tokens.reshape(1, -1),
                 "languages": languages.reshape(1, -1),
                 "word_div": word_div.reshape(1, -1),
@@ -782,11 +1512,9 @@ class DiffSingerService:
             encoder_out, x_masks = ling_dur_out
 
             # Duration predictor: encoder_out + x_masks + ph_midi + spk_embed
-            spk_tok = np.tile(
-                spk_embed_vec.reshape(1, 1, -1), (1, n_tokens, 1)
-            ).astype(np.float32)
+            spk_tok = _broadcast_spk_embed(spk_embed_vec, n_tokens)
 
-            dur_out = dur_model.run(None, {
+            dur_out = _run_bound(dur_model, {
                 "encoder_out": encoder_out,
                 "x_masks": x_masks,
                 "ph_midi": ph_midi.reshape(1, -1),
@@ -810,14 +1538,25 @@ class DiffSingerService:
             )
 
         n_frames = int(durations.sum())
+        if preview_seconds:
+            logger.info(
+                "preview_janela",
+                preview_active=True,
+                preview_seconds=preview_seconds,
+                n_frames=n_frames,
+            )
 
         # Computar note_dur a partir das durações preditas por fonema
+        # (soma segmentada numa chamada; palavras sem fonemas ficam com 0)
         note_dur = np.zeros(n_words, dtype=np.int64)
-        ph_idx = 0
-        for w in range(n_words):
-            n_ph = int(word_div[w])
-            note_dur[w] = int(durations[ph_idx:ph_idx + n_ph].sum())
-            ph_idx += n_ph
+        word_start = np.cumsum(word_div) - word_div
+        nonempty = word_div > 0
+        if nonempty.any():
+            note_dur[nonempty] = np.add.reduceat(durations, word_start[nonempty])
+
+        # Speaker embedding por frame, compartilhado por pitch e acoustic:
+        # materializado uma vez, o _run_bound liga o mesmo buffer sem nova cópia
+        spk_frames = np.ascontiguousarray(_broadcast_spk_embed(spk_embed_vec, n_frames))
 
         # ── 4. Predição de pitch (f0) ──
         ling_pitch_path = vb_root / "dspitch" / "files" / "linguistic.onnx"
@@ -826,15 +1565,11 @@ class DiffSingerService:
         if ling_pitch_path.exists() and pitch_model_path.exists():
             logger.info("usando_modelos_pitch", n_frames=n_frames)
 
-            ling_pitch = ort.InferenceSession(
-                str(ling_pitch_path), providers=["CPUExecutionProvider"]
-            )
-            pitch_model = ort.InferenceSession(
-                str(pitch_model_path), providers=["CPUExecutionProvider"]
-            )
+            ling_pitch = _ort_session(_model_variant(ling_pitch_path, precision))
+            pitch_model = _ort_session(_model_variant(pitch_model_path, precision))
 
             # Linguistic encoder (pitch): tokens + languages + ph_dur
-            ling_pitch_out = ling_pitch.run(None, {
+            ling_pitch_out = _run_bound(ling_pitch, {
                 "tokens": tokens.reshape(1, -1),
                 "languages": languages.reshape(1, -1),
                 "ph_dur": durations.reshape(1, -1),
@@ -842,24 +1577,20 @@ class DiffSingerService:
             encoder_out_p, x_masks_p = ling_pitch_out
 
             # Pitch predictor (diffusion): nota → contorno f0 natural
-            spk_frames = np.tile(
-                spk_embed_vec.reshape(1, 1, -1), (1, n_frames, 1)
-            ).astype(np.float32)
-
-            pitch_out = pitch_model.run(None, {
+            pitch_out = _run_bound(pitch_model, {
                 "encoder_out": encoder_out_p,
                 "ph_dur": durations.reshape(1, -1),
                 "note_midi": note_midi.reshape(1, -1),
                 "note_rest": note_rest.reshape(1, -1),
                 "note_dur": note_dur.reshape(1, -1),
-                "pitch": np.zeros((1, n_frames), dtype=np.float32),
-                "expr": np.ones((1, n_frames), dtype=np.float32),
-                "retake": np.ones((1, n_frames), dtype=bool),
+                "pitch": _const_frames(n_frames, 0.0, np.float32),
+                "expr": _const_frames(n_frames, 1.0, np.float32),
+                "retake": _const_frames(n_frames, True, np.bool_),
                 "spk_embed": spk_frames,
                 "steps": np.array(config.diffusion_steps, dtype=np.int64),
             })
 
-            f0_raw = pitch_out[0][0].astype(np.float32)  # (n_frames,)
+            f0_raw = pitch_out[0][0].astype(np.float32, copy=False)  # (n_frames,)
 
             # Pitch predictor produz valores em MIDI (semitones contínuos).
             # Converter para Hz e aplicar threshold de voicing (MIDI >= 30).
@@ -875,11 +1606,13 @@ class DiffSingerService:
             )
 
             # Converter MIDI → Hz, silenciando valores sub-vocais
-            f0 = np.where(
-                f0_raw >= VOICING_MIDI_THRESHOLD,
-                440.0 * (2.0 ** ((f0_raw - 69) / 12.0)),
-                0.0,
-            ).astype(np.float32)
+            # (exp2 num buffer float32 e máscara multiplicada, sem np.where)
+            voiced = f0_raw >= VOICING_MIDI_THRESHOLD
+            f0 = np.subtract(f0_raw, np.float32(69.0))
+            f0 *= np.float32(1.0 / 12.0)
+            np.exp2(f0, out=f0)
+            f0 *= np.float32(440.0)
+            f0 *= voiced
 
             voiced_f0 = f0[f0 > 1.0]
             logger.info(
@@ -892,99 +1625,25 @@ class DiffSingerService:
             logger.warning("modelos_pitch_ausentes_usando_estimativa")
             f0 = self._estimate_f0_fallback(ph_midi, durations, sr, hop_size)
 
-        # ── 5. Modelo acústico → mel spectrogram ──
-        acoustic_path = vb_root / "dsmain" / "acoustic.onnx"
-        if not acoustic_path.exists():
-            onnx_files = list(vb_root.rglob("acoustic.onnx"))
-            if not onnx_files:
-                raise FileNotFoundError(
-                    f"acoustic.onnx não encontrado em {vb_root}"
-                )
-            acoustic_path = onnx_files[0]
-
-        logger.info("acoustic_model_carregando", path=str(acoustic_path))
-        acoustic = ort.InferenceSession(
-            str(acoustic_path), providers=["CPUExecutionProvider"]
-        )
-
-        spk_frames = np.tile(
-            spk_embed_vec.reshape(1, 1, -1), (1, n_frames, 1)
-        ).astype(np.float32)
-
-        gender = np.full((1, n_frames), config.gender, dtype=np.float32)
-        velocity = np.full((1, n_frames), config.energy, dtype=np.float32)
-
-        acoustic_feeds = {
-            "tokens": tokens.reshape(1, -1),
-            "languages": languages.reshape(1, -1),
-            "durations": durations.reshape(1, -1),
-            "f0": f0.reshape(1, -1),
-            "gender": gender,
-            "velocity": velocity,
-            "spk_embed": spk_frames,
-            "steps": np.array(config.diffusion_steps, dtype=np.int64),
+        return {
+            "tokens": tokens,
+            "languages": languages,
+            "durations": durations,
+            "f0": f0,
+            "spk_frames": spk_frames,
         }
 
-        logger.info(
-            "acoustic_inference_iniciando",
-            n_tokens=n_tokens,
-            n_frames=n_frames,
-            steps=config.diffusion_steps,
-            shapes={k: v.shape for k, v in acoustic_feeds.items()},
-        )
-
-        mel_output = acoustic.run(None, acoustic_feeds)[0]  # (1, n_frames, 128)
-        logger.info("acoustic_inference_concluida", mel_shape=mel_output.shape)
-
-        # ── 6. Vocoder → waveform ──
-        vocoder_path = vb_root / "dsvocoder" / "tgm_hifigan_v110.onnx"
-        if not vocoder_path.exists():
-            voc_files = list(vb_root.rglob("*.onnx"))
-            voc_files = [
-                f for f in voc_files
-                if "vocoder" in f.name or "hifigan" in f.name
-            ]
-            if voc_files:
-                vocoder_path = voc_files[0]
-
-        if vocoder_path.exists():
-            logger.info("vocoder_carregando", path=str(vocoder_path))
-            vocoder = ort.InferenceSession(
-                str(vocoder_path), providers=["CPUExecutionProvider"]
-            )
-
-            waveform = vocoder.run(None, {
-                "mel": mel_output,
-                "f0": f0.reshape(1, -1),
-            })[0]  # (1, n_samples)
-            audio = waveform.squeeze().astype(np.float32)
-            logger.info("vocoder_concluido", samples=len(audio))
-        else:
-            logger.warning("vocoder_nao_encontrado_usando_griffin_lim")
-            audio = self._mel_to_audio(mel_output.squeeze(), sr, hop_size)
-
-        # ── 7. Normalizar e salvar ──
-        peak = np.max(np.abs(audio))
-        if peak > 0:
-            audio = (audio / peak * 0.85).astype(np.float32)
-
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        sf.write(str(output_path), audio, sr)
-
-        logger.info(
-            "diffsinger_pipeline_concluido",
-            output=str(output_path),
-            duration=len(audio) / sr,
-        )
-        return output_path
-
     def _mel_to_audio(self, mel: np.ndarray, sr: int, hop_size: int) -> np.ndarray:
         """Converte mel spectrogram para áudio via Griffin-Lim (fallback)."""
         try:
             import librosa
-            audio = librosa.feature.inverse.mel_to_audio(
-                mel.T if mel.shape[0] < mel.shape[1] else mel,
-                sr=sr, hop_length=hop_size, n_fft=2048,
+            # Saída do acoustic é (n_frames, n_mels); a base espera (n_mels, n_frames)
+            stft_mag = _mel_basis_inv(sr, 2048, mel.shape[1]) @ mel.T
+            np.maximum(stft_mag, 0.0, out=stft_mag)
+            # Griffin-Lim rápido (com momentum): converge em poucas iterações
+            audio = librosa.griffinlim(
+                stft_mag, n_iter=32, momentum=0.99, init="random",
+                hop_length=hop_size, n_fft=2048,
             )
             return audio.astype(np.float32)
         except Exception:
@@ -1002,9 +1661,7 @@ class DiffSingerService:
         sr = config.sample_rate
 
         if not notes:
-            audio = np.zeros(sr, dtype=np.float32)
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            sf.write(str(output_path), audio, sr)
+            _write_wav(output_path, np.zeros(sr, dtype=np.float32), sr)
             return output_path
 
         max_time = max(n["end_time"] for n in notes)
@@ -1014,46 +1671,25 @@ class DiffSingerService:
         total_samples = int(max_time * sr) + sr
         audio = np.zeros(total_samples, dtype=np.float32)
 
-        for note in notes:
-            start = int(note["start_time"] * sr)
-            end = int(note["end_time"] * sr)
-            if preview_seconds:
-                end = min(end, int(preview_seconds * sr))
-            if start >= total_samples or end <= start:
-                continue
+        starts = np.fromiter((n["start_time"] for n in notes), dtype=np.float64, count=len(notes))
+        ends = np.fromiter((n["end_time"] for n in notes), dtype=np.float64, count=len(notes))
+        midis = np.fromiter((n["midi_note"] for n in notes), dtype=np.float64, count=len(notes))
 
-            midi = note["midi_note"]
-            freq = 440.0 * (2.0 ** ((midi - 69) / 12.0))
-            duration_samples = end - start
-
-            t = np.linspace(0, (end - start) / sr, duration_samples, endpoint=False)
-
-            signal = (
-                0.5 * np.sin(2 * np.pi * freq * t)
-                + 0.25 * np.sin(2 * np.pi * freq * 2 * t)
-                + 0.12 * np.sin(2 * np.pi * freq * 3 * t)
-                + 0.06 * np.sin(2 * np.pi * freq * 4 * t)
-            )
-
-            attack = min(int(0.02 * sr), duration_samples // 4)
-            release = min(int(0.05 * sr), duration_samples // 4)
-            envelope = np.ones(duration_samples, dtype=np.float32)
-            if attack > 0:
-                envelope[:attack] = np.linspace(0, 1, attack)
-            if release > 0:
-                envelope[-release:] = np.linspace(1, 0, release)
-
-            signal *= envelope * 0.3
+        # Janelas (início, fim) em amostras, já recortadas pelo preview
+        start_idx = (starts * sr).astype(np.int64)
+        end_idx = (ends * sr).astype(np.int64)
+        if preview_seconds:
+            np.minimum(end_idx, int(preview_seconds * sr), out=end_idx)
+        keep = (start_idx < total_samples) & (end_idx > start_idx)
+        freqs = 440.0 * np.exp2((midis[keep] - 69) / 12.0) / sr
 
-            end_idx = min(start + duration_samples, total_samples)
-            audio[start:end_idx] += signal[: end_idx - start].astype(np.float32)
+        _synth_notes_kernel(
+            audio, start_idx[keep], end_idx[keep], freqs, int(0.02 * sr), int(0.05 * sr)
+        )
 
-        peak = np.max(np.abs(audio))
-        if peak > 0:
-            audio = audio / peak * 0.8
+        _normalize_peak_kernel(audio, 0.8)
 
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        sf.write(str(output_path), audio, sr)
+        _write_wav(output_path, audio, sr)
 
         logger.info(
             "placeholder_vocal_gerado",
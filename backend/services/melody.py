@@ -1,36 +1,503 @@
 """Serviço de melodia — extração MIDI, manipulação e exportação."""
 
 import asyncio
+import hashlib
 import json
+import multiprocessing
+import os
+import threading
+from collections.abc import AsyncIterator, Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import cache
 from pathlib import Path
 
 import librosa
 import numpy as np
+import soundfile as sf
 import structlog
 
+# Serialização JSON em C quando disponível
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson é opcional
+    orjson = None
+
 logger = structlog.get_logger()
 
+# Taxa da extração de melodia: o range vocal (até C6, ~1047 Hz) fica bem
+# abaixo de Nyquist e menos amostras por segundo barateiam o pyin
+MELODY_SR = 16000
+
+# Pool de processos compartilhado pelas extrações de melodia (criado sob demanda)
+_MELODY_POOL: ProcessPoolExecutor | None = None
+
 # Constantes MIDI
 MIDI_NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
 
 
+# Nomes pré-calculados do range MIDI (to_dict e o piano roll pedem um por nota)
+_MIDI_NAMES = tuple(f"{MIDI_NOTE_NAMES[n % 12]}{(n // 12) - 1}" for n in range(128))
+
+
 def midi_note_to_name(midi_note: int) -> str:
     """Converte número MIDI para nome da nota (ex: 60 -> C4)."""
+    if 0 <= midi_note < 128:
+        return _MIDI_NAMES[midi_note]
     octave = (midi_note // 12) - 1
     note = MIDI_NOTE_NAMES[midi_note % 12]
     return f"{note}{octave}"
 
 
+# Semitom de cada nome de nota (C = 0 ... B = 11)
+_NAME_TO_SEMITONE = {name: i for i, name in enumerate(MIDI_NOTE_NAMES)}
+
+
 def note_name_to_midi(name: str) -> int:
     """Converte nome da nota para número MIDI (ex: C4 -> 60)."""
-    note = name[:-1]
-    octave = int(name[-1])
-    return MIDI_NOTE_NAMES.index(note) + (octave + 1) * 12
+    semitone = _NAME_TO_SEMITONE.get(name[:-1])
+    if semitone is None:
+        raise ValueError(f"Nota inválida: {name}")
+    return semitone + (int(name[-1]) + 1) * 12
+
+
+def notes_to_midi(names: list[str]) -> np.ndarray:
+    """Versão em lote de note_name_to_midi: cada nome distinto é convertido uma vez."""
+    if not names:
+        return np.empty(0, dtype=np.int64)
+    unique, inverse = np.unique(np.asarray(names, dtype=str), return_inverse=True)
+    values = np.fromiter(
+        (note_name_to_midi(name) for name in unique.tolist()), dtype=np.int64, count=len(unique)
+    )
+    return values[inverse]
+
+
+def _audio_cache_path(audio_path: Path) -> Path:
+    """Path do .npy com o áudio decodificado (chave: path, tamanho, mtime, taxa)."""
+    from config import settings
+
+    stat = audio_path.stat()
+    key = f"{audio_path.resolve()}|{stat.st_size}|{stat.st_mtime_ns}|{MELODY_SR}"
+    digest = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+    return settings.storage_path / "cache" / "melody" / f"{digest}.f32.npy"
+
+
+def _load_audio(audio_path: Path) -> np.ndarray:
+    """Áudio mono float32 em MELODY_SR, decodificado uma vez por arquivo.
+
+    Extrações seguintes do mesmo arquivo abrem o .npy em cache via memmap
+    (somente leitura), sem decodificar nem reamostrar de novo.
+    """
+    cache = _audio_cache_path(audio_path)
+    if cache.exists():
+        try:
+            y = np.load(cache, mmap_mode="r")
+            os.utime(cache)  # marca como usado para a evicção LRU
+            return y
+        except (OSError, ValueError) as e:
+            logger.warning("melody_audio_cache_invalido", path=cache.name, error=str(e))
+
+    y, _ = librosa.load(str(audio_path), sr=MELODY_SR, mono=True, dtype=np.float32)
+
+    # Escrita atômica via arquivo temporário
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache.with_name(f"{cache.stem}.{os.getpid()}.{threading.get_ident()}.tmp.npy")
+    try:
+        np.save(tmp, y)
+        os.replace(tmp, cache)
+    except OSError as e:
+        tmp.unlink(missing_ok=True)
+        logger.warning("melody_audio_cache_falhou", path=cache.name, error=str(e))
+    else:
+        _evict_audio_cache(cache.parent)
+    return y
+
+
+def _evict_audio_cache(cache_dir: Path) -> None:
+    """Remove os .npy menos usados (mtime mais antigo) até caber no limite.
+
+    Entradas de arquivos reenviados ou de projetos apagados deixam de ser
+    usadas e saem primeiro. Um memmap aberto continua válido após o unlink.
+    """
+    from config import settings
+
+    max_bytes = settings.melody_audio_cache_max_mb * 1024 * 1024
+    entries = []
+    for path in cache_dir.glob("*.f32.npy"):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    if total <= max_bytes:
+        return
+    for _, size, path in sorted(entries, key=lambda e: e[0]):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+# pyin em blocos paralelos. Cada bloco leva uma margem de frames de cada lado
+# para o Viterbi do pyin convergir antes do trecho aproveitado
+_PYIN_HOP = 512  # hop padrão do librosa.pyin (frame_length 2048 // 4)
+_PYIN_MARGIN_FRAMES = 64
+_PYIN_MIN_CHUNK_FRAMES = 1024  # ~33 s a 16 kHz; abaixo disso, uma chamada só
+
+# Limite de threads do pyin em blocos; None usa todos os núcleos. Os processos
+# do pool de melodia fixam 1 para o paralelismo ficar só entre extrações
+_PYIN_MAX_THREADS: int | None = None
+
+
+def _pyin_chunked(
+    y: np.ndarray, sr: int, fmin: float, fmax: float
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """librosa.pyin dividido em blocos de frames processados em threads.
+
+    Com center=True o frame j de um trecho iniciado no frame a é o frame a + j
+    do sinal inteiro. Com a margem de 64 frames o resultado é igual ao da
+    chamada única.
+    """
+    n_frames = 1 + len(y) // _PYIN_HOP
+    max_threads = _PYIN_MAX_THREADS or os.cpu_count() or 1
+    workers = min(max_threads, n_frames // _PYIN_MIN_CHUNK_FRAMES)
+    if workers <= 1:
+        return librosa.pyin(y, fmin=fmin, fmax=fmax, sr=sr, hop_length=_PYIN_HOP)
+
+    def run(first: int, last: int) -> tuple[np.ndarray, ...]:
+        lo = max(0, first - _PYIN_MARGIN_FRAMES)
+        hi = min(n_frames, last + _PYIN_MARGIN_FRAMES)
+        out = librosa.pyin(
+            y[lo * _PYIN_HOP : hi * _PYIN_HOP],
+            fmin=fmin, fmax=fmax, sr=sr, hop_length=_PYIN_HOP,
+        )
+        return tuple(x[first - lo : last - lo] for x in out)
+
+    bounds = np.linspace(0, n_frames, workers + 1).astype(np.int64).tolist()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(run, bounds[:-1], bounds[1:]))
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+
+# torchcrepe: hop de 256 amostras do sinal original (o torchcrepe reamostra
+# para 16 kHz internamente) e limiar de periodicidade para considerar o frame vozeado
+_CREPE_HOP = 256
+_CREPE_VOICED_THRESHOLD = 0.21
+
+# pyworld (dio + stonemask): hop de 80 amostras, 5 ms a 16 kHz. O dio não dá
+# probabilidade de voz: frames com f0 > 0 contam como vozeados
+_WORLD_HOP = 80
+
+
+def _backend_hop(backend: str) -> int:
+    """Hop em amostras dos frames de f0 de cada backend."""
+    return {"torchcrepe": _CREPE_HOP, "pyworld": _WORLD_HOP}.get(backend, _PYIN_HOP)
+
+
+@cache
+def _select_pitch_backend(preference: str = "auto") -> str:
+    """Escolhe o estimador de f0: "torchcrepe" (GPU), "pyworld" ou "pyin".
+
+    "auto" usa torchcrepe só com CUDA disponível; "pyworld" só quando pedido
+    (mais rápido na CPU, menos robusto a ruído). Sem a dependência instalada
+    (deploy leve), qualquer preferência cai no pyin.
+    """
+    if preference == "pyin":
+        return "pyin"
+    if preference == "pyworld":
+        try:
+            import pyworld  # noqa: F401
+        except ImportError:
+            return "pyin"
+        return "pyworld"
+    try:
+        import torch
+        import torchcrepe  # noqa: F401
+    except ImportError:
+        return "pyin"
+    if preference == "torchcrepe" or torch.cuda.is_available():
+        return "torchcrepe"
+    return "pyin"
+
+
+def _estimate_f0(
+    y: np.ndarray, sr: int, fmin: float, fmax: float, backend: str = "pyin"
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """Estima f0 por frame: (f0, voiced_flag, voiced_probs, hop_length).
+
+    Mesmo formato do librosa.pyin em qualquer backend: f0 em Hz com NaN
+    onde não há voz e probabilidade de voz em [0, 1].
+    """
+    if backend == "pyworld":
+        import pyworld
+
+        x = np.asarray(y, dtype=np.float64)
+        frame_period = 1000.0 * _WORLD_HOP / sr  # ms
+        f0, t = pyworld.dio(x, sr, f0_floor=fmin, f0_ceil=fmax, frame_period=frame_period)
+        f0 = pyworld.stonemask(x, f0, t, sr)
+        voiced_flag = f0 > 0
+        f0[~voiced_flag] = np.nan
+        return f0, voiced_flag, voiced_flag.astype(np.float64), _WORLD_HOP
+
+    if backend != "torchcrepe":
+        f0, voiced_flag, voiced_probs = _pyin_chunked(y, sr, fmin, fmax)
+        return f0, voiced_flag, voiced_probs, _PYIN_HOP
+
+    import torch
+    import torchcrepe
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    with torch.inference_mode():
+        pitch, periodicity = torchcrepe.predict(
+            torch.from_numpy(np.array(y, dtype=np.float32)).unsqueeze(0),
+            sr,
+            hop_length=_CREPE_HOP,
+            fmin=fmin,
+            fmax=fmax,
+            model="tiny",
+            batch_size=2048,
+            device=device,
+            return_periodicity=True,
+        )
+    f0 = pitch[0].cpu().numpy().astype(np.float64)
+    voiced_probs = periodicity[0].cpu().numpy().astype(np.float64)
+    voiced_flag = voiced_probs >= _CREPE_VOICED_THRESHOLD
+    f0[~voiced_flag] = np.nan
+    return f0, voiced_flag, voiced_probs, _CREPE_HOP
+
+
+def _merge_groups(
+    starts: np.ndarray, ends: np.ndarray, midis: np.ndarray, gap_threshold: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """Grupos de notas consecutivas com mesmo pitch e gap < gap_threshold.
+
+    Devolve (primeira, última) nota de cada grupo, em índices. O grupo começa
+    na primeira nota e termina no fim da última.
+    """
+    joins = (midis[1:] == midis[:-1]) & (starts[1:] - ends[:-1] < gap_threshold)
+    heads = np.flatnonzero(np.concatenate(([True], ~joins)))
+    lasts = np.append(heads[1:] - 1, len(starts) - 1)
+    return heads, lasts
+
+
+def _note_columns(notes: list["MelodyNote"]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Colunas (início, fim, nota MIDI) de uma lista de notas."""
+    count = len(notes)
+    return (
+        np.fromiter((n.start_time for n in notes), dtype=np.float64, count=count),
+        np.fromiter((n.end_time for n in notes), dtype=np.float64, count=count),
+        np.fromiter((n.midi_note for n in notes), dtype=np.int64, count=count),
+    )
+
+
+def _pitch_outlier_mask(midis: np.ndarray, max_jump: int) -> np.ndarray:
+    """Notas internas que saltam > max_jump semitons da anterior e da próxima."""
+    mask = np.zeros(len(midis), dtype=np.bool_)
+    if len(midis) > 2:
+        jumps = np.abs(np.diff(midis))
+        mask[1:-1] = (jumps[:-1] > max_jump) & (jumps[1:] > max_jump)
+    return mask
+
+
+# Range vocal humano: C3 (130Hz) a C6 (1047Hz)
+# Evita capturar baixo/guitarra (abaixo de C3) e harmônicos (acima de C6)
+_VOCAL_FMIN = librosa.note_to_hz("C3")   # ~130 Hz
+_VOCAL_FMAX = librosa.note_to_hz("C6")   # ~1047 Hz
+
+# MIDI range vocal: 48 (C3) a 84 (C6)
+_MIDI_MIN = 48
+_MIDI_MAX = 84
+
+
+def _frames_to_midi(
+    f0: np.ndarray, voiced_flag: np.ndarray, voiced_probs: np.ndarray
+) -> np.ndarray:
+    """Nota MIDI por frame; -1 onde não há voz, confiança mínima ou range vocal."""
+    valid = voiced_flag & (voiced_probs > 0.3) & (f0 > 0)  # NaN > 0 é False
+    # Mesma fórmula do librosa.hz_to_midi, 12 * (log2(f) - log2(440)) + 69,
+    # calculada in-place sobre os frames válidos
+    semitones = np.log2(f0[valid])
+    semitones -= np.log2(440.0)
+    semitones *= 12
+    semitones += 69
+    midi = np.full(len(f0), -1, dtype=np.int64)
+    midi[valid] = np.round(semitones, out=semitones)
+    midi[(midi < _MIDI_MIN) | (midi > _MIDI_MAX)] = -1
+    return midi
+
+
+def _segment_notes(
+    midi: np.ndarray, hop_time: float
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Colunas (início, fim, nota MIDI) das notas de uma sequência de frames.
+
+    Aplica o filtro de 100 ms e o agrupamento de notas próximas; a remoção de
+    outliers fica com quem chama.
+    """
+    # Run-length: cada trecho contínuo com a mesma nota vira uma nota,
+    # terminando no início do frame seguinte (ou um hop após o último frame)
+    bounds = np.flatnonzero(np.diff(midi, prepend=-1, append=-1))
+    run_starts = bounds[:-1]
+    run_notes = midi[run_starts]
+    run_start_times = run_starts * hop_time
+    run_end_times = bounds[1:] * hop_time
+
+    # Só trechos com nota e de pelo menos 100 ms
+    keep = (run_notes >= 0) & (run_end_times - run_start_times >= 0.1)
+    starts = run_start_times[keep]
+    ends = run_end_times[keep]
+    midis = run_notes[keep]
+
+    # Agrupar notas próximas com mesmo pitch (gap até 150ms)
+    if len(midis) > 1:
+        heads, lasts = _merge_groups(starts, ends, midis, gap_threshold=0.15)
+        starts, ends, midis = starts[heads], ends[lasts], midis[heads]
+    return starts, ends, midis
+
+
+# Extração em streaming: áudio novo analisado por vez (a margem de frames do
+# pyin em blocos é somada de cada lado)
+_STREAM_BLOCK_SECONDS = 5.0
+
+
+def _iter_audio_blocks(audio_path: Path, block_samples: int) -> Iterator[np.ndarray]:
+    """Áudio mono float32 em MELODY_SR, em blocos, sem carregar o arquivo inteiro.
+
+    A reamostragem é contínua entre blocos (soxr em streaming). Formatos que o
+    soundfile não lê (ex: m4a) caem no _load_audio, fatiado em blocos.
+    """
+    try:
+        native_sr = sf.info(str(audio_path)).samplerate
+    except RuntimeError:
+        y = _load_audio(audio_path)
+        for start in range(0, len(y), block_samples):
+            yield np.asarray(y[start : start + block_samples])
+        return
+
+    import soxr
+
+    resampler = None
+    if native_sr != MELODY_SR:
+        resampler = soxr.ResampleStream(native_sr, MELODY_SR, 1, dtype="float32", quality="HQ")
+    native_block = max(1, block_samples * native_sr // MELODY_SR)
+    for block in sf.blocks(
+        str(audio_path), blocksize=native_block, dtype="float32", always_2d=True
+    ):
+        mono = block.mean(axis=1)
+        yield mono if resampler is None else resampler.resample_chunk(mono)
+    if resampler is not None:
+        yield resampler.resample_chunk(np.empty(0, dtype=np.float32), last=True)
+
+
+def _iter_melody_notes(audio_path: Path, pitch_backend: str = "pyin") -> Iterator["MelodyNote"]:
+    """Notas da melodia na ordem, entregues assim que ficam definitivas.
+
+    O áudio é lido em blocos e cada bloco de frames passa pelo estimador de f0
+    com a mesma margem do pyin em blocos. A segmentação roda sobre as notas
+    MIDI de todos os frames já analisados (8 bytes por frame); todas as notas
+    menos a última são definitivas, porque só a última ainda pode crescer ou
+    ser agrupada com a próxima.
+    """
+    hop = _backend_hop(pitch_backend)
+    hop_time = hop / MELODY_SR
+    block_frames = int(_STREAM_BLOCK_SECONDS * MELODY_SR) // hop
+
+    buffer = np.empty(0, dtype=np.float32)
+    buffer_start = 0  # amostra global de buffer[0]
+    total = 0  # amostras lidas até aqui
+    done = 0  # frames já analisados
+    midi_parts: list[np.ndarray] = []
+    emitted = 0  # notas (antes da remoção de outliers) já decididas
+
+    blocks = _iter_audio_blocks(audio_path, block_frames * hop)
+    finished = False
+    while not finished:
+        chunk = next(blocks, None)
+        if chunk is None:
+            finished = True
+        else:
+            buffer = np.concatenate((buffer, chunk))
+            total += len(chunk)
+
+        # Blocos de frames cujo áudio (com a margem à direita) já chegou
+        while True:
+            if finished:
+                last = 1 + total // hop
+                if last <= done:
+                    break
+                hi = last
+            else:
+                last = done + block_frames
+                hi = last + _PYIN_MARGIN_FRAMES
+                if hi * hop > total:
+                    break
+            lo = max(0, done - _PYIN_MARGIN_FRAMES)
+            segment = buffer[lo * hop - buffer_start : hi * hop - buffer_start]
+            f0, voiced_flag, voiced_probs, _ = _estimate_f0(
+                segment, MELODY_SR, _VOCAL_FMIN, _VOCAL_FMAX, pitch_backend
+            )
+            core = slice(done - lo, last - lo)
+            midi_parts.append(_frames_to_midi(f0[core], voiced_flag[core], voiced_probs[core]))
+            done = last
+
+            # Descartar o áudio que nenhum bloco futuro vai reler
+            drop = max(0, (done - _PYIN_MARGIN_FRAMES) * hop - buffer_start)
+            buffer = buffer[drop:]
+            buffer_start += drop
+
+        if not midi_parts:
+            continue
+        starts, ends, midis = _segment_notes(np.concatenate(midi_parts), hop_time)
+        outliers = _pitch_outlier_mask(midis, max_jump=12)
+        ready = len(midis) if finished else len(midis) - 1
+        for k in range(emitted, ready):
+            if not outliers[k]:
+                yield MelodyNote(
+                    start_time=float(starts[k]), end_time=float(ends[k]), midi_note=int(midis[k])
+                )
+        emitted = max(emitted, ready)
+
+
+def _get_melody_pool() -> ProcessPoolExecutor:
+    """Retorna o pool de extração de melodia, criando-o na primeira chamada.
+
+    Usa spawn para não herdar por fork as threads do event loop e do torch.
+    """
+    global _MELODY_POOL
+    if _MELODY_POOL is None:
+        _MELODY_POOL = ProcessPoolExecutor(
+            max_workers=max(1, (os.cpu_count() or 2) // 2),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_melody_worker,
+        )
+    return _MELODY_POOL
+
+
+def shutdown_melody_pool() -> None:
+    """Encerra o pool de extração de melodia, se tiver sido criado."""
+    global _MELODY_POOL
+    if _MELODY_POOL is not None:
+        _MELODY_POOL.shutdown(wait=False, cancel_futures=True)
+        _MELODY_POOL = None
+
+
+def _init_melody_worker() -> None:
+    """Inicializa o processo do pool: pyin numa thread só, sem oversubscription."""
+    global _PYIN_MAX_THREADS
+    _PYIN_MAX_THREADS = 1
+
+
+def _extract_in_worker(audio_path: Path, bpm: float, pitch_backend: str) -> "MelodyData":
+    """Ponto de entrada picklável executado nos processos do pool."""
+    return MelodyService(pitch_backend)._extract_melody_sync(audio_path, bpm)
 
 
 class MelodyNote:
     """Representa uma nota no piano roll."""
 
+    # Sem __dict__ por instância: menos memória e acesso mais rápido em melodias longas
+    __slots__ = ("start_time", "end_time", "midi_note", "velocity", "lyric")
+
     def __init__(
         self,
         start_time: float,
@@ -51,6 +518,8 @@ class MelodyNote:
 
     @property
     def note_name(self) -> str:
+        if 0 <= self.midi_note < 128:
+            return _MIDI_NAMES[self.midi_note]
         return midi_note_to_name(self.midi_note)
 
     def to_dict(self) -> dict:
@@ -89,8 +558,30 @@ class MelodyData:
         self.time_signature = time_signature
 
     def to_dict(self) -> dict:
+        # Mesmo formato de MelodyNote.to_dict, com o arredondamento feito em lote
+        notes = self.notes
+        count = len(notes)
+        starts = np.fromiter((n.start_time for n in notes), dtype=np.float64, count=count)
+        ends = np.fromiter((n.end_time for n in notes), dtype=np.float64, count=count)
+        rows = zip(
+            np.round(starts, 4).tolist(),
+            np.round(ends, 4).tolist(),
+            np.round(ends - starts, 4).tolist(),
+            notes,
+        )
         return {
-            "notes": [n.to_dict() for n in self.notes],
+            "notes": [
+                {
+                    "start_time": start,
+                    "end_time": end,
+                    "duration": duration,
+                    "midi_note": n.midi_note,
+                    "note_name": n.note_name,
+                    "velocity": n.velocity,
+                    "lyric": n.lyric,
+                }
+                for start, end, duration, n in rows
+            ],
             "bpm": self.bpm,
             "time_signature": list(self.time_signature),
             "total_notes": len(self.notes),
@@ -107,116 +598,100 @@ class MelodyData:
 
     def snap_to_grid(self, grid_resolution: float = 0.125) -> None:
         """Quantiza notas para o grid mais próximo (em beats)."""
+        if not self.notes:
+            return
         beat_duration = 60.0 / self.bpm
         grid_time = grid_resolution * beat_duration
-        for note in self.notes:
-            note.start_time = round(note.start_time / grid_time) * grid_time
-            note.end_time = round(note.end_time / grid_time) * grid_time
-            if note.end_time <= note.start_time:
-                note.end_time = note.start_time + grid_time
+        count = len(self.notes)
+        starts = np.fromiter((n.start_time for n in self.notes), dtype=np.float64, count=count)
+        ends = np.fromiter((n.end_time for n in self.notes), dtype=np.float64, count=count)
+
+        # np.round arredonda meio para par, como o round() do Python
+        starts = np.round(starts / grid_time) * grid_time
+        ends = np.round(ends / grid_time) * grid_time
+        ends = np.where(ends <= starts, starts + grid_time, ends)
+
+        for note, start, end in zip(self.notes, starts.tolist(), ends.tolist()):
+            note.start_time = start
+            note.end_time = end
 
 
 class MelodyService:
     """Serviço para extração, manipulação e exportação de melodias MIDI."""
 
+    def __init__(self, pitch_backend: str | None = None):
+        from config import settings
+
+        # None → settings.melody_pitch_backend
+        self.pitch_backend = _select_pitch_backend(
+            pitch_backend or settings.melody_pitch_backend
+        )
+
     async def extract_melody_from_audio(
         self, audio_path: Path, bpm: float = 120.0
     ) -> MelodyData:
-        """Extrai melodia de um arquivo de áudio usando análise de pitch."""
-        return await asyncio.to_thread(
-            self._extract_melody_sync, audio_path, bpm
+        """Extrai melodia de um arquivo de áudio usando análise de pitch.
+
+        Roda no pool de processos: extrações simultâneas em paralelo real, sem
+        disputar o GIL com o event loop. Dentro de um processo daemon (worker
+        prefork do Celery) não é possível criar processos filhos, então a
+        extração roda numa thread.
+        """
+        if multiprocessing.current_process().daemon:
+            return await asyncio.to_thread(self._extract_melody_sync, audio_path, bpm)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _get_melody_pool(), _extract_in_worker, audio_path, bpm, self.pitch_backend
         )
 
-    def _extract_melody_sync(self, audio_path: Path, bpm: float) -> MelodyData:
-        """Extração síncrona de melodia usando librosa pyin."""
-        logger.info("melody_extraction_iniciada", file=str(audio_path))
+    async def extract_melody_from_audio_stream(
+        self, audio_path: Path
+    ) -> AsyncIterator[MelodyNote]:
+        """Extrai melodia em blocos, entregando cada nota assim que é definida.
 
-        y, sr = librosa.load(str(audio_path), sr=22050, mono=True)
+        Memória de áudio limitada a um bloco (com margens), independente da
+        duração do arquivo; as notas saem iguais às de extract_melody_from_audio.
+        """
+        logger.info(
+            "melody_stream_iniciado", file=str(audio_path), backend=self.pitch_backend
+        )
+        notes = _iter_melody_notes(audio_path, self.pitch_backend)
+        total_notes = 0
+        try:
+            while (note := await asyncio.to_thread(next, notes, None)) is not None:
+                total_notes += 1
+                yield note
+        finally:
+            notes.close()
+        logger.info("melody_stream_concluido", total_notes=total_notes)
 
-        # Range vocal humano: C3 (130Hz) a C6 (1047Hz)
-        # Evita capturar baixo/guitarra (abaixo de C3) e harmônicos (acima de C6)
-        fmin = librosa.note_to_hz("C3")   # ~130 Hz
-        fmax = librosa.note_to_hz("C6")   # ~1047 Hz
+    def _extract_melody_sync(self, audio_path: Path, bpm: float) -> MelodyData:
+        """Extração síncrona de melodia (torchcrepe na GPU, pyworld ou librosa pyin)."""
+        logger.info(
+            "melody_extraction_iniciada", file=str(audio_path), backend=self.pitch_backend
+        )
 
-        f0, voiced_flag, voiced_probs = librosa.pyin(
-            y,
-            fmin=fmin,
-            fmax=fmax,
-            sr=sr,
+        y = _load_audio(audio_path)
+        sr = MELODY_SR
+
+        f0, voiced_flag, voiced_probs, hop_length = _estimate_f0(
+            y, sr, _VOCAL_FMIN, _VOCAL_FMAX, self.pitch_backend
         )
 
-        # Converter frequências para notas MIDI
-        times = librosa.times_like(f0, sr=sr)
-        hop_time = times[1] - times[0] if len(times) > 1 else 0.01
-
-        notes: list[MelodyNote] = []
-        current_note: int | None = None
-        note_start: float = 0.0
-
-        # MIDI range vocal: 48 (C3) a 84 (C6)
-        MIDI_MIN = 48
-        MIDI_MAX = 84
-
-        for i, (freq, is_voiced, prob) in enumerate(
-            zip(f0, voiced_flag, voiced_probs)
-        ):
-            time = times[i]
-
-            if (
-                is_voiced
-                and not np.isnan(freq)
-                and freq > 0
-                and prob > 0.3  # Exigir confiança mínima
-            ):
-                midi_note = int(round(librosa.hz_to_midi(freq)))
-
-                # Rejeitar notas fora do range vocal
-                if midi_note < MIDI_MIN or midi_note > MIDI_MAX:
-                    if current_note is not None:
-                        notes.append(MelodyNote(
-                            start_time=note_start,
-                            end_time=time,
-                            midi_note=current_note,
-                        ))
-                        current_note = None
-                    continue
-
-                if current_note is None:
-                    current_note = midi_note
-                    note_start = time
-                elif midi_note != current_note:
-                    notes.append(MelodyNote(
-                        start_time=note_start,
-                        end_time=time,
-                        midi_note=current_note,
-                    ))
-                    current_note = midi_note
-                    note_start = time
-            else:
-                if current_note is not None:
-                    notes.append(MelodyNote(
-                        start_time=note_start,
-                        end_time=time,
-                        midi_note=current_note,
-                    ))
-                    current_note = None
-
-        # Última nota
-        if current_note is not None:
-            notes.append(MelodyNote(
-                start_time=note_start,
-                end_time=times[-1] + hop_time,
-                midi_note=current_note,
-            ))
-
-        # Filtrar notas muito curtas (< 100ms)
-        notes = [n for n in notes if n.duration >= 0.1]
-
-        # Agrupar notas próximas com mesmo pitch (gap até 150ms)
-        notes = self._merge_close_notes(notes, gap_threshold=0.15)
+        # Frame i começa em i * hop_time (mesma conta do librosa.times_like)
+        midi = _frames_to_midi(f0, voiced_flag, voiced_probs)
+        starts, ends, midis = _segment_notes(midi, hop_length / sr)
 
         # Remover outliers: notas que pulam > 12 semitons (1 oitava) das vizinhas
-        notes = self._remove_pitch_outliers(notes, max_jump=12)
+        keep = ~_pitch_outlier_mask(midis, max_jump=12)
+
+        # Objetos só no fim, depois do pós-processamento em arrays
+        notes = [
+            MelodyNote(start_time=start, end_time=end, midi_note=midi_note)
+            for start, end, midi_note in zip(
+                starts[keep].tolist(), ends[keep].tolist(), midis[keep].tolist()
+            )
+        ]
 
         melody = MelodyData(notes=notes, bpm=bpm)
 
@@ -232,17 +707,14 @@ class MelodyService:
         self, notes: list[MelodyNote], gap_threshold: float = 0.05
     ) -> list[MelodyNote]:
         """Agrupa notas adjacentes com mesmo pitch separadas por gap pequeno."""
-        if not notes:
+        if len(notes) <= 1:
             return notes
 
-        merged: list[MelodyNote] = [notes[0]]
-        for note in notes[1:]:
-            prev = merged[-1]
-            gap = note.start_time - prev.end_time
-            if note.midi_note == prev.midi_note and gap < gap_threshold:
-                prev.end_time = note.end_time
-            else:
-                merged.append(note)
+        starts, ends, midis = _note_columns(notes)
+        heads, lasts = _merge_groups(starts, ends, midis, gap_threshold)
+        merged = [notes[i] for i in heads.tolist()]
+        for note, last in zip(merged, lasts.tolist()):
+            note.end_time = notes[last].end_time
         return merged
 
     def _remove_pitch_outliers(
@@ -255,21 +727,9 @@ class MelodyService:
         if len(notes) <= 2:
             return notes
 
-        filtered: list[MelodyNote] = [notes[0]]
-        for i in range(1, len(notes) - 1):
-            prev_midi = notes[i - 1].midi_note
-            curr_midi = notes[i].midi_note
-            next_midi = notes[i + 1].midi_note
-
-            jump_prev = abs(curr_midi - prev_midi)
-            jump_next = abs(curr_midi - next_midi)
-
-            if jump_prev > max_jump and jump_next > max_jump:
-                continue  # Outlier — descartar
-            filtered.append(notes[i])
-
-        filtered.append(notes[-1])
-        return filtered
+        midis = np.fromiter((n.midi_note for n in notes), dtype=np.int64, count=len(notes))
+        outliers = _pitch_outlier_mask(midis, max_jump)
+        return [note for note, is_outlier in zip(notes, outliers.tolist()) if not is_outlier]
 
     async def import_midi(self, midi_path: Path, bpm: float = 120.0) -> MelodyData:
         """Importa melodia de um arquivo MIDI externo."""
@@ -283,39 +743,65 @@ class MelodyService:
 
         mid = mido.MidiFile(str(midi_path))
 
-        # Extrair BPM do MIDI se disponível
+        # Eventos de nota em colunas (tick absoluto, nota, é note_on), na ordem
+        # de leitura: tracks em sequência, cada uma com seu próprio relógio.
+        # Na mesma passada, o primeiro set_tempo de cada track (vale o da última
+        # track que tiver um)
+        ticks: list[int] = []
+        pitches: list[int] = []
+        is_on: list[bool] = []
+        tempo = None
         for track in mid.tracks:
+            tick = 0
+            track_tempo = None
             for msg in track:
-                if msg.type == "set_tempo":
-                    bpm = round(mido.tempo2bpm(msg.tempo), 1)
-                    break
-
-        # Extrair notas
-        notes: list[MelodyNote] = []
-        active_notes: dict[int, float] = {}
-        current_time = 0.0
+                tick += msg.time
+                kind = msg.type
+                if kind == "note_on" or kind == "note_off":
+                    ticks.append(tick)
+                    pitches.append(msg.note)
+                    is_on.append(kind == "note_on" and msg.velocity > 0)
+                elif kind == "set_tempo" and track_tempo is None:
+                    track_tempo = msg.tempo
+            if track_tempo is not None:
+                tempo = track_tempo
 
-        # Usar primeira track com notas (ou mesclar todas)
-        for track in mid.tracks:
-            current_time = 0.0
-            for msg in track:
-                current_time += mido.tick2second(msg.time, mid.ticks_per_beat, mido.bpm2tempo(bpm))
-
-                if msg.type == "note_on" and msg.velocity > 0:
-                    active_notes[msg.note] = current_time
-                elif msg.type == "note_off" or (msg.type == "note_on" and msg.velocity == 0):
-                    if msg.note in active_notes:
-                        start = active_notes.pop(msg.note)
-                        if current_time - start >= 0.05:
-                            notes.append(MelodyNote(
-                                start_time=start,
-                                end_time=current_time,
-                                midi_note=msg.note,
-                                velocity=100,
-                            ))
-
-        # Ordenar por tempo
-        notes.sort(key=lambda n: n.start_time)
+        # Extrair BPM do MIDI se disponível
+        if tempo is not None:
+            bpm = round(mido.tempo2bpm(tempo), 1)
+
+        tick_arr = np.array(ticks, dtype=np.int64)
+        seconds_per_tick = mido.bpm2tempo(bpm) * 1e-6 / mid.ticks_per_beat
+        pitch_arr = np.array(pitches, dtype=np.int64)
+        on_arr = np.array(is_on, dtype=np.bool_)
+
+        # Pareamento: agrupados por nota (ordem de leitura preservada), um
+        # note_off fecha a nota se o evento anterior da mesma nota é um note_on
+        # (um note_on repetido reinicia a nota; note_off sem nota ativa é ignorado)
+        order = np.lexsort((np.arange(len(pitch_arr)), pitch_arr))
+        grouped_pitch = pitch_arr[order]
+        grouped_on = on_arr[order]
+        closes = np.zeros(len(order), dtype=np.bool_)
+        closes[1:] = ~grouped_on[1:] & grouped_on[:-1] & (grouped_pitch[1:] == grouped_pitch[:-1])
+        off_idx = order[closes]
+        on_idx = order[np.flatnonzero(closes) - 1]
+
+        # Duração mínima de 50 ms comparada em ticks inteiros (sem ruído de float)
+        keep = tick_arr[off_idx] - tick_arr[on_idx] >= 0.05 / seconds_per_tick - 1e-9
+        on_idx, off_idx = on_idx[keep], off_idx[keep]
+        starts = tick_arr[on_idx] * seconds_per_tick
+        ends = tick_arr[off_idx] * seconds_per_tick
+
+        # Ordenar por início (empates na ordem em que as notas foram fechadas)
+        by_start = np.lexsort((off_idx, starts))
+        notes = [
+            MelodyNote(start_time=start, end_time=end, midi_note=midi_note, velocity=100)
+            for start, end, midi_note in zip(
+                starts[by_start].tolist(),
+                ends[by_start].tolist(),
+                pitch_arr[off_idx][by_start].tolist(),
+            )
+        ]
 
         logger.info(
             "midi_import_concluido",
@@ -340,8 +826,12 @@ class MelodyService:
         track = mido.MidiTrack()
         mid.tracks.append(track)
 
+        # Tempo e escala de tempo calculados uma vez para todos os eventos
+        tempo = mido.bpm2tempo(melody.bpm)
+        seconds_per_tick = tempo * 1e-6 / mid.ticks_per_beat
+
         # Metadata
-        track.append(mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(melody.bpm)))
+        track.append(mido.MetaMessage("set_tempo", tempo=tempo))
         track.append(mido.MetaMessage(
             "time_signature",
             numerator=melody.time_signature[0],
@@ -349,42 +839,59 @@ class MelodyService:
         ))
         track.append(mido.MetaMessage("track_name", name="Vocal Melody"))
 
-        # Converter notas
-        tempo = mido.bpm2tempo(melody.bpm)
-        events: list[tuple[float, str, int, int]] = []
-
-        for note in melody.notes:
-            events.append((note.start_time, "note_on", note.midi_note, note.velocity))
-            events.append((note.end_time, "note_off", note.midi_note, 0))
-
-            # Adicionar lyric como evento se presente
-            if note.lyric:
-                events.append((note.start_time, "lyric", 0, 0))
-
-        events.sort(key=lambda e: e[0])
-
-        prev_time = 0.0
-        lyric_idx = 0
-        lyrics_list = [n.lyric for n in melody.notes if n.lyric]
-
-        for time, event_type, note_val, vel in events:
-            delta_seconds = time - prev_time
-            delta_ticks = int(mido.second2tick(delta_seconds, mid.ticks_per_beat, tempo))
-            delta_ticks = max(0, delta_ticks)
-
-            if event_type == "lyric":
-                if lyric_idx < len(lyrics_list):
-                    track.append(mido.MetaMessage(
-                        "lyrics", text=lyrics_list[lyric_idx], time=delta_ticks
-                    ))
-                    lyric_idx += 1
+        # Converter notas: cada nota gera note_on, note_off e (se tiver letra)
+        # um evento lyric no início, montados em colunas na ordem nota a nota
+        notes = melody.notes
+        count = len(notes)
+        starts = np.fromiter((n.start_time for n in notes), dtype=np.float64, count=count)
+        ends = np.fromiter((n.end_time for n in notes), dtype=np.float64, count=count)
+        has_lyric = np.fromiter((bool(n.lyric) for n in notes), dtype=np.bool_, count=count)
+
+        # kind: 0 = note_on, 1 = note_off, 2 = lyric; (count, 3) achatado em ordem de nota
+        times = np.stack([starts, ends, starts], axis=1).ravel()
+        kinds = np.tile(np.arange(3), count)
+        note_idx = np.repeat(np.arange(count), 3)
+        present = np.ones((count, 3), dtype=np.bool_)
+        present[:, 2] = has_lyric
+        present = present.ravel()
+        times, kinds, note_idx = times[present], kinds[present], note_idx[present]
+
+        # Ordenação estável por tempo (empates mantêm a ordem de inserção). No
+        # legato, o note_off de uma nota fica antes do note_on da seguinte no
+        # mesmo tick: um merge de streams por (tempo, tipo) inverteria isso e
+        # cortaria notas repetidas. O argsort é uma fração mínima da exportação
+        order = np.argsort(times, kind="stable")
+        times, kinds, note_idx = times[order], kinds[order], note_idx[order]
+
+        # Delta em ticks entre eventos consecutivos (mesmo arredondamento do mido.second2tick)
+        delta_ticks = np.maximum(
+            np.round(np.diff(times, prepend=0.0) / seconds_per_tick), 0
+        ).astype(np.int64)
+
+        # Validação das notas uma vez por coluna (mesmos erros do mido), o que
+        # permite criar as mensagens com skip_checks
+        midi_notes = [n.midi_note for n in notes]
+        velocities = [n.velocity for n in notes]
+        for column in (np.asarray(midi_notes), np.asarray(velocities)):
+            if column.size and column.dtype.kind not in "iu":
+                raise TypeError("data byte must be int")
+            if column.size and (column.min() < 0 or column.max() > 127):
+                raise ValueError("data byte must be in range 0..127")
+
+        lyrics_list = iter([n.lyric for n in notes if n.lyric])
+        for kind, idx, ticks in zip(kinds.tolist(), note_idx.tolist(), delta_ticks.tolist()):
+            if kind == 2:
+                track.append(mido.MetaMessage("lyrics", text=next(lyrics_list), time=ticks))
+            elif kind == 0:
+                track.append(mido.Message(
+                    "note_on", skip_checks=True,
+                    note=midi_notes[idx], velocity=velocities[idx], time=ticks,
+                ))
             else:
                 track.append(mido.Message(
-                    event_type, note=note_val, velocity=vel, time=delta_ticks
+                    "note_off", skip_checks=True, note=midi_notes[idx], velocity=0, time=ticks,
                 ))
 
-            prev_time = time
-
         output_path.parent.mkdir(parents=True, exist_ok=True)
         mid.save(str(output_path))
 
@@ -394,13 +901,19 @@ class MelodyService:
     def save_melody_json(self, melody: MelodyData, output_path: Path) -> None:
         """Salva melodia em formato JSON interno."""
         output_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(output_path, "w") as f:
-            json.dump(melody.to_dict(), f, indent=2)
+        if orjson is None:
+            with open(output_path, "w") as f:
+                json.dump(melody.to_dict(), f, indent=2)
+            return
+        output_path.write_bytes(orjson.dumps(
+            melody.to_dict(),
+            option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY,
+        ))
 
     def load_melody_json(self, json_path: Path) -> MelodyData:
         """Carrega melodia de formato JSON interno."""
-        with open(json_path) as f:
-            data = json.load(f)
+        raw = json_path.read_bytes()
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
         return MelodyData.from_dict(data)
 
     def assign_lyrics_to_notes(
@@ -1,6 +1,8 @@
 """Serviço de mixagem e masterização com Pedalboard."""
 
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
 import numpy as np
@@ -10,6 +12,35 @@ import structlog
 logger = structlog.get_logger()
 
 
+@lru_cache(maxsize=32)
+def _eq_sos(sr: int, low_db: float, mid_db: float, high_db: float) -> np.ndarray:
+    """Cascata SOS do EQ de fallback, cacheada por taxa e ganhos.
+
+    Cada banda soma ao sinal a própria saída filtrada escalada por (ganho - 1):
+    H = 1 + (g - 1)·B/A = (A + (g - 1)·B) / A, um filtro da mesma ordem da
+    banda. Como as etapas são em série, o EQ inteiro vira uma cascata só.
+    """
+    from scipy import signal
+
+    # High-pass em 80Hz para limpar graves
+    sections = [signal.butter(2, 80, btype="high", fs=sr, output="sos")]
+
+    # Low shelf em 250Hz, mid peak em 2.5kHz, high shelf em 8kHz
+    bands = (
+        (low_db, 1, 250, "low"),
+        (mid_db, 2, [1500, 4000], "band"),
+        (high_db, 1, 8000, "high"),
+    )
+    for gain_db, order, freq, btype in bands:
+        if abs(gain_db) > 0.5:
+            gain = 10 ** (gain_db / 20.0)
+            b, a = signal.butter(order, freq, btype=btype, fs=sr)
+            sections.append(signal.tf2sos(a + (gain - 1) * b, a))
+
+    # Sem flag de somente leitura: o sosfilt exige buffer gravável (não escreve nele)
+    return np.vstack(sections)
+
+
 class MixPreset:
     """Preset de mixagem com parâmetros pré-definidos."""
 
@@ -206,28 +237,6 @@ class MixerService:
         import pedalboard
         from pedalboard.io import AudioFile
 
-        # Ler vocal
-        with AudioFile(str(vocal_path)) as f:
-            vocal_audio = f.read(f.frames)
-            vocal_sr = f.samplerate
-
-        # Ler instrumental
-        with AudioFile(str(instrumental_path)) as f:
-            inst_audio = f.read(f.frames)
-            inst_sr = f.samplerate
-
-        # Resample se necessário
-        if vocal_sr != config.sample_rate:
-            import librosa
-            vocal_audio = librosa.resample(
-                vocal_audio, orig_sr=vocal_sr, target_sr=config.sample_rate
-            )
-        if inst_sr != config.sample_rate:
-            import librosa
-            inst_audio = librosa.resample(
-                inst_audio, orig_sr=inst_sr, target_sr=config.sample_rate
-            )
-
         sr = config.sample_rate
 
         # Cadeia de efeitos no vocal
@@ -265,9 +274,16 @@ class MixerService:
             pedalboard.Gain(gain_db=config.instrumental_gain_db),
         ])
 
-        # Processar
-        vocal_processed = vocal_board(vocal_audio, sr)
-        inst_processed = inst_board(inst_audio, sr)
+        # Vocal e instrumental são independentes: leitura, resample e cadeia
+        # de efeitos em duas threads (o Pedalboard libera o GIL no I/O e no DSP)
+        def process(path: Path, board: "pedalboard.Pedalboard") -> np.ndarray:
+            return board(self._read_track(path, sr), sr)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            vocal_future = executor.submit(process, vocal_path, vocal_board)
+            inst_future = executor.submit(process, instrumental_path, inst_board)
+            vocal_processed = vocal_future.result()
+            inst_processed = inst_future.result()
 
         # Alinhar durações (pad com silêncio)
         vocal_channels = vocal_processed.shape[0] if vocal_processed.ndim > 1 else 1
@@ -316,6 +332,22 @@ class MixerService:
         logger.info("mix_pedalboard_concluido", output=str(output_path))
         return output_path
 
+    def _read_track(self, path: Path, sr: int) -> np.ndarray:
+        """Lê uma faixa com o Pedalboard, reamostrando para sr se necessário."""
+        from pedalboard.io import AudioFile
+
+        with AudioFile(str(path)) as f:
+            audio = f.read(f.frames)
+            track_sr = f.samplerate
+
+        if track_sr != sr:
+            import soxr
+
+            # Mesmo resampler do librosa.resample (soxr HQ), chamado direto sobre
+            # (frames, canais): sem o wrapper por canal nem o import do librosa
+            audio = np.ascontiguousarray(soxr.resample(audio.T, track_sr, sr, quality="HQ").T)
+        return audio
+
     def _mix_fallback(
         self,
         vocal_path: Path,
@@ -379,52 +411,29 @@ class MixerService:
     def _apply_simple_eq(
         self, audio: np.ndarray, sr: int, config: MixConfig
     ) -> np.ndarray:
-        """EQ simplificado com filtros de shelving."""
+        """EQ simplificado com filtros de shelving, numa única passada sosfilt."""
         from scipy import signal
 
-        # High-pass em 80Hz para limpar graves
-        sos = signal.butter(2, 80, btype="high", fs=sr, output="sos")
-        audio = signal.sosfilt(sos, audio).astype(np.float32)
-
-        # Low shelf em 250Hz
-        if abs(config.eq_low_gain_db) > 0.5:
-            gain = 10 ** (config.eq_low_gain_db / 20.0)
-            sos = signal.butter(1, 250, btype="low", fs=sr, output="sos")
-            low = signal.sosfilt(sos, audio).astype(np.float32)
-            audio = audio + low * (gain - 1)
-
-        # Mid peak em 2.5kHz
-        if abs(config.eq_mid_gain_db) > 0.5:
-            gain = 10 ** (config.eq_mid_gain_db / 20.0)
-            sos = signal.butter(2, [1500, 4000], btype="band", fs=sr, output="sos")
-            mid = signal.sosfilt(sos, audio).astype(np.float32)
-            audio = audio + mid * (gain - 1)
-
-        # High shelf em 8kHz
-        if abs(config.eq_high_gain_db) > 0.5:
-            gain = 10 ** (config.eq_high_gain_db / 20.0)
-            sos = signal.butter(1, 8000, btype="high", fs=sr, output="sos")
-            high = signal.sosfilt(sos, audio).astype(np.float32)
-            audio = audio + high * (gain - 1)
-
-        return audio
+        sos = _eq_sos(
+            sr, config.eq_low_gain_db, config.eq_mid_gain_db, config.eq_high_gain_db
+        )
+        return signal.sosfilt(sos, audio).astype(np.float32)
 
     def _apply_simple_compression(
         self, audio: np.ndarray, threshold_db: float, ratio: float
     ) -> np.ndarray:
         """Compressão simplificada."""
         threshold = 10 ** (threshold_db / 20.0)
-        output = np.copy(audio)
 
-        above_mask = np.abs(output) > threshold
-        if np.any(above_mask):
-            signs = np.sign(output[above_mask])
-            magnitudes = np.abs(output[above_mask])
-            excess = magnitudes - threshold
-            compressed = threshold + excess / ratio
-            output[above_mask] = signs * compressed
-
-        return output
+        # Acima do limiar, |x| vira threshold + (|x| - threshold) / ratio, ou
+        # seja, x - sign(x) * max(|x| - threshold, 0) * (1 - 1/ratio): passadas
+        # contíguas in-place, sem máscara nem gather/scatter
+        reduction = np.abs(audio)
+        reduction -= threshold
+        np.maximum(reduction, 0, out=reduction)
+        reduction *= 1.0 - 1.0 / ratio
+        np.copysign(reduction, audio, out=reduction)
+        return np.subtract(audio, reduction, out=reduction)
 
     def _apply_simple_reverb(
         self,
@@ -438,18 +447,22 @@ class MixerService:
         if delay_samples < 1:
             return audio
 
-        reverb = np.zeros_like(audio)
         feedback = 0.5 * room_size
         num_taps = 6
 
+        # FIR esparso (um tap a cada delay_samples) somado in-place na saída:
+        # cada tap é uma fatia deslocada, sem np.pad nem buffer de reverb
+        output = audio * (1.0 - wet_level)
+        scaled = np.empty_like(audio)
         for i in range(num_taps):
             tap_delay = delay_samples * (i + 1)
-            tap_gain = feedback ** (i + 1)
-            if tap_delay < len(audio):
-                padded = np.pad(audio, (tap_delay, 0))[:len(audio)]
-                reverb += padded * tap_gain
+            if tap_delay >= len(audio):
+                break
+            tap_gain = feedback ** (i + 1) * wet_level
+            np.multiply(audio[:-tap_delay], tap_gain, out=scaled[:-tap_delay])
+            output[tap_delay:] += scaled[:-tap_delay]
 
-        return audio * (1.0 - wet_level) + reverb * wet_level
+        return output
 
     async def export(
         self,
@@ -598,3 +598,79 @@ class TestQuickStartAPI:
             )
         assert response.status_code == 201
         assert response.json()["synthesis_engine"] == "diffsinger"
+
+
+# ============================================================
+# Testes do WebSocket ConnectionManager
+# ============================================================
+class _FakeWebSocket:
+    """WebSocket mínimo para testar o ConnectionManager sem servidor."""
+
+    def __init__(self, subprotocols: list[str] | None = None, broken: bool = False) -> None:
+        from starlette.websockets import WebSocketState
+
+        self.scope = {"subprotocols": subprotocols or []}
+        self.client_state = WebSocketState.CONNECTED
+        self.accepted_subprotocol = None
+        self.close_code = None
+        self.broken = broken
+        self.sent: list = []
+
+    async def accept(self, subprotocol: str | None = None) -> None:
+        self.accepted_subprotocol = subprotocol
+
+    async def close(self, code: int = 1000) -> None:
+        from starlette.websockets import WebSocketState
+
+        self.close_code = code
+        self.client_state = WebSocketState.DISCONNECTED
+
+    async def send_text(self, data: str) -> None:
+        if self.broken:
+            raise ConnectionError("socket fechado")
+        self.sent.append(data)
+
+    async def send_bytes(self, data: bytes) -> None:
+        self.sent.append(data)
+
+
+class TestConnectionManager:
+    """Testes para o broadcast de progresso via WebSocket."""
+
+    @pytest.mark.asyncio
+    async def test_msgpack_subprotocol_receives_binary_frames(self):
+        """Clientes que negociam msgpack recebem bytes; os demais, texto JSON."""
+        import json
+
+        import msgpack
+
+        from api.websocket import ConnectionManager
+
+        manager = ConnectionManager()
+        json_ws = _FakeWebSocket()
+        msgpack_ws = _FakeWebSocket(subprotocols=["msgpack"])
+        await manager.connect(json_ws, "p1")
+        await manager.connect(msgpack_ws, "p1")
+
+        payload = json.dumps({"type": "progress", "progress": 42})
+        await manager.send_to_project("p1", payload)
+
+        assert msgpack_ws.accepted_subprotocol == "msgpack"
+        assert json_ws.sent == [payload]
+        assert msgpack.unpackb(msgpack_ws.sent[0]) == {"type": "progress", "progress": 42}
+
+    @pytest.mark.asyncio
+    async def test_dead_connection_is_closed_and_removed(self):
+        """Conexões que falham no envio são fechadas com 1011 e removidas."""
+        from api.websocket import ConnectionManager
+
+        manager = ConnectionManager()
+        alive = _FakeWebSocket()
+        dead = _FakeWebSocket(broken=True)
+        await manager.connect(alive, "p1")
+        await manager.connect(dead, "p1")
+
+        await manager.send_to_project("p1", "{}")
+
+        assert dead.close_code == 1011
+        assert manager.connections["p1"] == [alive]
@@ -1,6 +1,8 @@
 """Testes para os serviços de backend."""
 
+import asyncio
 import json
+import multiprocessing
 import tempfile
 from pathlib import Path
 
@@ -9,6 +11,37 @@ import pytest
 import soundfile as sf
 
 
+def _run_in_daemon(target, *args):
+    """Executa target(*args) num processo daemon, como um worker prefork do Celery."""
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=target, args=(queue, *args), daemon=True)
+    proc.start()
+    result = queue.get(timeout=120)
+    proc.join(timeout=10)
+    return result
+
+
+def _analyze_in_daemon(queue, audio_path):
+    from services.analyzer import AudioAnalyzer
+
+    try:
+        result = asyncio.run(AudioAnalyzer().analyze(audio_path))
+        queue.put(result.duration_seconds)
+    except Exception as e:
+        queue.put(repr(e))
+
+
+def _extract_melody_in_daemon(queue, audio_path):
+    from services.melody import MelodyService
+
+    try:
+        melody = asyncio.run(MelodyService().extract_melody_from_audio(audio_path, bpm=120.0))
+        queue.put(melody.bpm)
+    except Exception as e:
+        queue.put(repr(e))
+
+
 # ============================================================
 # Testes do AudioAnalyzer
 # ============================================================
@@ -40,6 +73,13 @@ class TestAudioAnalyzer:
 
         assert abs(result.duration_seconds - 2.0) < 0.5
 
+    def test_analyze_inside_daemon_process(self, sample_audio_path):
+        """Dentro de processo daemon (Celery prefork) a análise não cria pool."""
+        duration = _run_in_daemon(_analyze_in_daemon, sample_audio_path)
+
+        assert isinstance(duration, float), duration
+        assert abs(duration - 2.0) < 0.5
+
     @pytest.mark.asyncio
     async def test_generate_waveform_peaks(self, sample_audio_path):
         """Verifica que os picos de waveform são gerados."""
@@ -72,6 +112,67 @@ class TestMelodyService:
         # Pode ou não ter notas dependendo do conteúdo
         assert isinstance(melody.notes, list)
 
+    def test_extract_melody_inside_daemon_process(self, sample_audio_path):
+        """Dentro de processo daemon (Celery prefork) a extração não cria pool."""
+        bpm = _run_in_daemon(_extract_melody_in_daemon, sample_audio_path)
+
+        assert bpm == 120.0
+
+    @pytest.mark.asyncio
+    async def test_extract_melody_stream_matches_batch(self, tmp_project_dir):
+        """Streaming em blocos entrega as mesmas notas da extração completa."""
+        from services.melody import MelodyService
+
+        # 12 s de notas sustentadas: atravessa vários blocos do streaming
+        sr = 22050
+        t = np.arange(int(sr * 1.5)) / sr
+        audio = np.concatenate([
+            0.5 * np.sin(2 * np.pi * 440 * 2 ** ((midi - 69) / 12) * t)
+            for midi in (60, 64, 67, 72, 67, 64, 62, 60)
+        ])
+        audio_path = tmp_project_dir / "stream.wav"
+        sf.write(str(audio_path), audio, sr)
+
+        svc = MelodyService("pyin")
+        batch = svc._extract_melody_sync(audio_path, bpm=120.0)
+        streamed = [n async for n in svc.extract_melody_from_audio_stream(audio_path)]
+
+        assert len(streamed) >= 4
+        assert [n.to_dict() for n in streamed] == [n.to_dict() for n in batch.notes]
+
+    def test_load_audio_cache(self, sample_audio_path):
+        """Áudio decodificado uma vez em 16 kHz float32 e reaberto via memmap."""
+        from services.melody import MELODY_SR, _audio_cache_path, _load_audio
+
+        y = _load_audio(sample_audio_path)
+        assert y.dtype == np.float32
+        assert abs(len(y) - 2 * MELODY_SR) <= 1
+        assert _audio_cache_path(sample_audio_path).exists()
+
+        cached = _load_audio(sample_audio_path)
+        assert isinstance(cached, np.memmap)
+        assert np.array_equal(cached, y)
+
+    def test_audio_cache_eviction(self, tmp_project_dir, monkeypatch):
+        """Cache de áudio remove os .npy menos usados ao estourar o limite."""
+        import os
+
+        from config import settings
+        from services.melody import _evict_audio_cache
+
+        monkeypatch.setattr(settings, "melody_audio_cache_max_mb", 1)
+        cache_dir = tmp_project_dir / "melody-cache"
+        cache_dir.mkdir()
+        paths = [cache_dir / f"{name}.f32.npy" for name in ("old", "new")]
+        for i, path in enumerate(paths):
+            np.save(path, np.zeros(150_000, dtype=np.float32))  # ~0,6 MB
+            os.utime(path, (1000 + i, 1000 + i))
+
+        _evict_audio_cache(cache_dir)
+
+        assert not paths[0].exists()
+        assert paths[1].exists()
+
     @pytest.mark.asyncio
     async def test_save_and_load_melody_json(self, tmp_project_dir):
         """Verifica serialização JSON de ida e volta."""
@@ -204,6 +305,127 @@ class TestDiffSingerService:
         # Em ambiente de teste, o engine não está instalado
         assert isinstance(svc.is_available(), bool)
 
+    def test_voicebank_index_cache(self, tmp_path):
+        """Índice de voicebanks é reaproveitado e invalidado ao instalar um novo."""
+        from services.diffsinger import DiffSingerService
+
+        def install(name: str) -> Path:
+            vb_dir = tmp_path / "italian" / name
+            (vb_dir / "dsmain").mkdir(parents=True)
+            (vb_dir / "dsmain" / "acoustic.onnx").touch()
+            (vb_dir / "dsconfig.yaml").write_text("speakers: [soprano]\n")
+            return vb_dir
+
+        umidaji = install("umidaji")
+        svc = DiffSingerService()
+        svc.voicebanks_path = tmp_path
+
+        assert svc.is_available()
+        assert [vb["speakers"] for vb in svc.list_voicebanks()] == [["soprano"]]
+        assert svc._find_voicebank_root("Umidaji") == umidaji
+        assert svc._voicebank_index() is svc._voicebank_index()
+
+        install("tenore")
+        assert {vb["name"] for vb in svc.list_voicebanks()} == {"umidaji", "tenore"}
+
+    def test_g2p_cached(self):
+        """G2P memoizado retorna os mesmos fonemas e reaproveita o cache."""
+        from services.diffsinger import _g2p, _g2p_cached
+
+        _g2p_cached.cache_clear()
+        assert _g2p_cached("gli", "it") == tuple(_g2p("gli", "it")) == ("pt/lh", "es/i")
+        assert _g2p_cached("coração", "pt") == tuple(_g2p("coração", "pt"))
+        _g2p_cached("gli", "it")
+        assert _g2p_cached.cache_info().hits == 1
+
+    def test_estimate_durations_fallback(self):
+        """Durações por fonema somam a duração da palavra; vogais ficam com o resto."""
+        from services.diffsinger import DiffSingerService
+
+        svc = DiffSingerService()
+        phoneme_map = {"SP": 0, "pt/k": 1, "pt/a": 2}
+        durations = svc._estimate_durations_fallback(
+            np.array([0, 1, 2, 0]),
+            np.array([1, 2, 1]),
+            np.array([10, 50, 1]),
+            phoneme_map,
+        )
+        assert durations.tolist() == [10, 4, 46, 1]
+
+    def test_estimate_f0_fallback(self):
+        """f0 de fallback: 0 Hz em pausas, frequência da nota e vibrato no fim."""
+        from services.diffsinger import DiffSingerService
+
+        svc = DiffSingerService()
+        f0 = svc._estimate_f0_fallback(
+            np.array([0, 69]), np.array([5, 100]), sr=44100, hop_size=512
+        )
+        assert f0.shape == (105,)
+        assert f0.dtype == np.float32
+        assert np.all(f0[:5] == 0.0)
+        assert np.allclose(f0[5:45], 440.0)
+        assert np.abs(f0[45:] - 440.0).max() > 1.0
+
+    def test_feeds_cache(self, tmp_path):
+        """Cache de feeds: chave ignora gender/energy e o .npz faz round-trip."""
+        from services.diffsinger import (
+            DiffSingerConfig,
+            _feeds_cache_path,
+            _load_feeds,
+            _save_feeds,
+        )
+
+        notes = [{"start_time": 0.0, "end_time": 0.5, "midi_note": 60, "lyric": "la"}]
+        path = _feeds_cache_path(notes, DiffSingerConfig(), tmp_path, "fp32")
+        assert path == _feeds_cache_path(notes, DiffSingerConfig(gender=0.3), tmp_path, "fp32")
+        assert path != _feeds_cache_path(notes, DiffSingerConfig(speaker="b"), tmp_path, "fp32")
+        assert path != _feeds_cache_path(notes, DiffSingerConfig(), tmp_path, "int8")
+        assert _load_feeds(path) is None
+
+        features = {
+            "tokens": np.array([1, 2], dtype=np.int64),
+            "languages": np.array([5, 5], dtype=np.int64),
+            "durations": np.array([10, 20], dtype=np.int64),
+            "f0": np.full(30, 261.6, dtype=np.float32),
+            "spk_frames": np.zeros((1, 30, 4), dtype=np.float32),
+        }
+        _save_feeds(path, features)
+        loaded = _load_feeds(path)
+        assert set(loaded) == {"tokens", "languages", "durations", "f0"}
+        assert np.array_equal(loaded["f0"], features["f0"])
+
+    def test_feeds_cache_touch_and_eviction(self, tmp_path, monkeypatch):
+        """Hit atualiza o mtime do .npz e os menos usados saem ao estourar o limite."""
+        import os
+
+        from config import settings
+        from services.diffsinger import _FEEDS_KEYS, _load_feeds, _save_feeds
+
+        monkeypatch.setattr(settings, "diffsinger_feeds_cache_max_mb", 1)
+        features = {key: np.zeros(40_000, dtype=np.float32) for key in _FEEDS_KEYS}  # ~0,6 MB
+        first, second = tmp_path / "a.npz", tmp_path / "b.npz"
+
+        _save_feeds(first, features)
+        os.utime(first, (1000, 1000))
+        assert _load_feeds(first) is not None
+        assert first.stat().st_mtime > 1000
+
+        os.utime(first, (1000, 1000))
+        _save_feeds(second, features)
+        assert not first.exists()
+        assert second.exists()
+        assert _load_feeds(second) is not None
+
+    def test_mel_to_audio_fallback(self):
+        """Griffin-Lim de fallback aceita mel (n_frames, n_mels) longo e gera áudio."""
+        from services.diffsinger import DiffSingerService
+
+        mel = np.abs(np.random.default_rng(0).standard_normal((300, 128))).astype(np.float32)
+        audio = DiffSingerService()._mel_to_audio(mel, sr=44100, hop_size=512)
+        assert audio.dtype == np.float32
+        assert abs(len(audio) - 300 * 512) <= 512
+        assert np.abs(audio).max() > 0.0
+
     @pytest.mark.asyncio
     async def test_placeholder_synthesis(self, tmp_project_dir):
         """Verifica que placeholder gera arquivo WAV."""
@@ -262,6 +484,88 @@ class TestACEStepService:
         data, sr = sf.read(str(output_path))
         assert len(data) > 0
 
+    def test_render_cache_hit_and_eviction(self, tmp_project_dir):
+        """Cache devolve renders armazenados e remove os menos usados ao estourar o limite."""
+        from services.acestep import ACEStepConfig, RenderCache
+
+        render = tmp_project_dir / "render.wav"
+        render.write_bytes(b"x" * 100)
+        cache = RenderCache(tmp_project_dir / "cache", max_bytes=150)
+
+        key_a = RenderCache.make_key(ACEStepConfig(lyrics="a", seed=1))
+        key_b = RenderCache.make_key(ACEStepConfig(lyrics="b", seed=1))
+        assert key_a != key_b
+
+        cache.put(key_a, render)
+        out = tmp_project_dir / "out.wav"
+        assert cache.get(key_a, out)
+        assert out.read_bytes() == render.read_bytes()
+
+        cache.put(key_b, render)
+        assert not cache.get(key_a, out)
+        assert cache.get(key_b, out)
+
+
+# ============================================================
+# Testes do DemucsService
+# ============================================================
+class TestDemucsService:
+    """Testes para o serviço de separação de fontes."""
+
+    def test_failed_separation_invalidates_cached_stems(self, tmp_project_dir, monkeypatch):
+        """Falha no meio da gravação não deixa stems mistos com .sig válido."""
+        import sys
+        import types
+
+        torch = pytest.importorskip("torch")
+        import services.demucs as demucs_svc
+
+        calls = []
+        model = types.SimpleNamespace(
+            samplerate=8000, audio_channels=2, sources=["drums", "bass", "other", "vocals"],
+        )
+
+        def apply_model(model, mix, **kwargs):
+            calls.append(mix.shape)
+            return torch.rand(1, 4, 2, 800)
+
+        class AudioFile:
+            def __init__(self, path):
+                pass
+
+            def read(self, **kwargs):
+                return torch.rand(2, 800)
+
+        monkeypatch.setitem(sys.modules, "demucs", types.ModuleType("demucs"))
+        monkeypatch.setitem(
+            sys.modules, "demucs.apply", types.SimpleNamespace(apply_model=apply_model)
+        )
+        monkeypatch.setitem(sys.modules, "demucs.audio", types.SimpleNamespace(AudioFile=AudioFile))
+        monkeypatch.setattr(demucs_svc, "_get_model", lambda: model)
+
+        input_a = tmp_project_dir / "a.wav"
+        input_b = tmp_project_dir / "b.wav"
+        input_a.write_bytes(b"a" * 100)
+        input_b.write_bytes(b"b" * 100)
+        output_dir = tmp_project_dir / "separated"
+        svc = demucs_svc.DemucsService()
+
+        svc._separate_sync(input_a, output_dir)
+        assert len(calls) == 1
+
+        def failing_write(*args, **kwargs):
+            raise OSError("disco cheio")
+
+        real_write = demucs_svc.sf.write
+        monkeypatch.setattr(demucs_svc.sf, "write", failing_write)
+        with pytest.raises(OSError):
+            svc._separate_sync(input_b, output_dir)
+        assert not (output_dir / ".sig").exists()
+
+        monkeypatch.setattr(demucs_svc.sf, "write", real_write)
+        svc._separate_sync(input_a, output_dir)
+        assert len(calls) == 3
+
 
 # ============================================================
 # Testes do RVCService
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Gera variantes quantizadas (int8 / fp16) dos modelos ONNX de um voicebank DiffSinger.
+
+Os arquivos são gravados ao lado dos originais (ex.: dsdur/files/dur.int8.onnx)
+e usados pelo backend quando DIFFSINGER_PRECISION=int8 (ou fp16).
+
+Uso: python scripts/quantize_voicebank.py engines/voicebanks/italian/umidaji [--precision int8]
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+_PRECISIONS = ("fp16", "int8")
+
+
+def _is_variant(path: Path) -> bool:
+    """True para arquivos já quantizados (*.int8.onnx / *.fp16.onnx)."""
+    return Path(path.stem).suffix.lstrip(".") in _PRECISIONS
+
+
+def _is_vocoder(path: Path) -> bool:
+    """Vocoders HiFi-GAN (ex.: dsvocoder/tgm_hifigan_v110.onnx)."""
+    name = path.name.lower()
+    return "vocoder" in name or "hifigan" in name or path.parent.name == "dsvocoder"
+
+
+def quantize_int8(src: Path, dst: Path) -> None:
+    """Quantização dinâmica: pesos de MatMul/Gemm/Conv em 8 bits por canal.
+
+    Modelos acústicos/duração/pitch usam QInt8. O vocoder usa QUInt8: nos
+    caminhos com tanh do HiFi-GAN o QInt8 satura e gera artefatos.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(
+        str(src),
+        str(dst),
+        op_types_to_quantize=["MatMul", "Gemm", "Conv"],
+        weight_type=QuantType.QUInt8 if _is_vocoder(src) else QuantType.QInt8,
+        per_channel=True,
+    )
+
+
+def convert_fp16(src: Path, dst: Path) -> None:
+    """Converte pesos para float16 mantendo entradas/saídas em float32."""
+    import onnx
+    from onnxconverter_common import float16
+
+    model = onnx.load(str(src))
+    model_fp16 = float16.convert_float_to_float16(model, keep_io_types=True)
+    onnx.save(model_fp16, str(dst))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("voicebank", type=Path, help="Diretório do voicebank")
+    parser.add_argument("--precision", choices=_PRECISIONS, default="int8")
+    parser.add_argument("--force", action="store_true", help="Regravar variantes existentes")
+    args = parser.parse_args()
+
+    if not args.voicebank.is_dir():
+        print(f"Voicebank não encontrado: {args.voicebank}", file=sys.stderr)
+        return 1
+
+    convert = quantize_int8 if args.precision == "int8" else convert_fp16
+    models = [p for p in sorted(args.voicebank.rglob("*.onnx")) if not _is_variant(p)]
+
+    for src in models:
+        dst = src.with_name(f"{src.stem}.{args.precision}{src.suffix}")
+        if dst.exists() and not args.force:
+            print(f"  = {dst.relative_to(args.voicebank)} (já existe)")
+            continue
+        try:
+            convert(src, dst)
+        except Exception as e:  # modelos com ops não suportados ficam em fp32
+            print(f"  ! {src.relative_to(args.voicebank)}: {e}", file=sys.stderr)
+            continue
+        ratio = dst.stat().st_size / src.stat().st_size
+        print(f"  ✓ {dst.relative_to(args.voicebank)} ({ratio:.0%} do original)")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())